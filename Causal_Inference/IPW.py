@@ -1,47 +1,84 @@
+import copy
+import json
+import os
 import pickle
 import time
 
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, Dataset, random_split, RandomSampler
+from torch.utils.data import Dataset, random_split, Sampler
 import torch.nn.functional as F
 from collections import Counter
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 
+from train_store import TRAIN_COLUMNS, load_columns
 
 
 class ListsDataset(Dataset):
+    """
+    the treatment model features, pre-stacked into a single [9, N] int64 tensor so a whole batch of indices is
+    served by one gather (see RandomBatchSampler)
+    """
 
     def __init__(self, raiser_position_, caller_position_, checked_to_, hands_,
                  hands_strength_, flops_strength_, hands_potential_, flops_potential_, cards_order_,
                  treatment_):
 
-        self.raiser_position_ = raiser_position_
-        self.caller_position_ = caller_position_
-        self.checked_to_ = checked_to_
-        self.hands_ = hands_
-        self.hands_strength_ = hands_strength_
-        self.flops_strength_ = flops_strength_
-        self.hands_potential_ = hands_potential_
-        self.flops_potential_ = flops_potential_
-        self.cards_order_ = cards_order_
-        self.treatment_ = treatment_
+        self.features = torch.stack([torch.as_tensor(np.asarray(f), dtype=torch.int64) for f in [
+            raiser_position_, caller_position_, checked_to_, hands_, hands_strength_, flops_strength_,
+            hands_potential_, flops_potential_, cards_order_]])
+        self.treatment_ = torch.as_tensor(np.asarray(treatment_), dtype=torch.int64)
+
+        (self.raiser_position_, self.caller_position_, self.checked_to_, self.hands_, self.hands_strength_,
+         self.flops_strength_, self.hands_potential_, self.flops_potential_, self.cards_order_) = self.features
+
+    @classmethod
+    def from_columns(cls, columns: dict, treatment_):
+        """ build the dataset over named train columns (e.g. load_columns output) """
+        return cls(columns['raiser_position'], columns['caller_position'], columns['checked_to'], columns['hands'],
+                   columns['hands_strength'], columns['flops_strength'], columns['hands_potential'],
+                   columns['flops_potential'], columns['cards_order'], treatment_)
 
     def __len__(self):
-        return len(self.hands_)
+        return len(self.treatment_)
 
     def __getitem__(self, idx):
-
-        x = [self.raiser_position_[idx], self.caller_position_[idx], self.checked_to_[idx], self.hands_[idx],
-         self.hands_strength_[idx], self.flops_strength_[idx], self.hands_potential_[idx], self.flops_potential_[idx],
-             self.cards_order_[idx]]
+        # idx is either a single index (x is a list of 9 features, as the default collate expects) or a batch of
+        # indices / a slice (x is [9, B])
+        x = self.features[:, idx]
         y = self.treatment_[idx]
 
+        if x.dim() == 1:
+            x = list(x)
         return x, y
 
 
+class RandomBatchSampler(Sampler):
+    """
+    yield whole batches of random indices as tensors, drawn with a single torch call per epoch.
+    use with DataLoader(dataset, sampler=RandomBatchSampler(...), batch_size=None), so ListsDataset gathers each
+    batch at once and no per-index python work is done
+    """
+
+    def __init__(self, data_source_size, batch_size, num_samples=None, replacement=True, generator=None):
+        self.data_source_size = data_source_size
+        self.batch_size = batch_size
+        self.num_samples = num_samples or data_source_size
+        self.replacement = replacement
+        self.generator = generator
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.replacement:
+            indices = torch.randint(self.data_source_size, (self.num_samples,), generator=self.generator)
+        else:
+            indices = torch.randperm(self.data_source_size, generator=self.generator)[:self.num_samples]
+        yield from indices.split(self.batch_size)
+
+
 class TreatmentPrediction(nn.Module):
 
     def __init__(self):
@@ -84,10 +121,15 @@ class TreatmentPrediction(nn.Module):
         out = self.fc2(out)
         return out
 
-    def train_model(self, label_balance, train_loader, test_loader, epochs):
-        print("Start Training . . .")
-        labels_weight = sum(label_balance) / label_balance
-        print("labels balance: ", [v.item() / sum(label_balance) for v in label_balance])
+    def train_model(self, label_balance, train_loader, test_loader, epochs, verbose=True):
+        """ train the model, with verbose=False nothing is printed or plotted (e.g. in bootstrap workers) """
+        labels_weight = None
+        if verbose:
+            print("Start Training . . .")
+        if label_balance is not None:
+            labels_weight = sum(label_balance) / label_balance
+            if verbose:
+                print("labels balance: ", [v.item() / sum(label_balance) for v in label_balance])
         # criterion = nn.CrossEntropyLoss(reduction='sum', weight=labels_weight)
         criterion = nn.CrossEntropyLoss(reduction='sum')
         optimizer = torch.optim.Adam(self.parameters(), lr=0.001)
@@ -111,14 +153,17 @@ class TreatmentPrediction(nn.Module):
 
             epoch_loss_val = epoch_loss / epoch_count
             tot_loss.append(epoch_loss_val)
-            if epoch % 10 == 0:
-                print(f'Epoch {epoch + 1}/{num_epochs}, Loss: {epoch_loss_val}')
+            if verbose and epoch % 10 == 0:
+                print(f'Epoch {epoch + 1}/{epochs}, Loss: {epoch_loss_val}')
 
             if test_loader is not None:
-                avg_loss, acc = self.evaluate_model(labels_weight, test_loader, epoch)
+                avg_loss, acc = self.evaluate_model(labels_weight, test_loader, epoch if verbose else 1)
                 test_results['loss'].append(avg_loss)
                 test_results['acc'].append(acc)
 
+        if not verbose:
+            return
+
         plt.plot(tot_loss, label='train')
         if test_loader is not None:
             plt.plot(test_results['loss'], label='test')
@@ -131,9 +176,83 @@ class TreatmentPrediction(nn.Module):
         plt.xlabel("epoch")
         plt.ylabel("bce loss")
         plt.show()
-        print(f"best test acc = {max(test_results['acc'])}")
+        if test_results['acc']:
+            print(f"best test acc = {max(test_results['acc'])}")
         print(f"model accuracy on train = {train_acc[1]}")
 
+    def fit(self, train_loader, val_loader=None, epochs=100, patience=None, checkpoint_path=None, log_path=None,
+            lr=0.001):
+        """
+        headless training, nothing is printed or plotted.
+        the monitored loss is the validation loss (the train loss if there is no 'val_loader'), the model ends up
+        with the weights of its best epoch.
+        :param patience: stop after this many epochs without improvement of the monitored loss
+        :param checkpoint_path: save the model, optimizer and best weights there after every epoch, and resume from
+        it if it exists
+        :param log_path: append the metrics of every epoch there, as json lines
+        :return: the metrics of every epoch run by this call
+        """
+        criterion = nn.CrossEntropyLoss(reduction='sum')
+        optimizer = torch.optim.Adam(self.parameters(), lr=lr)
+        state = {'epoch': 0, 'best_loss': float('inf'), 'best_epoch': -1, 'stopped': False}
+        best_weights = copy.deepcopy(self.state_dict())
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            checkpoint = torch.load(checkpoint_path)
+            self.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            best_weights, state = checkpoint['best_model'], checkpoint['state']
+
+        history = []
+        while state['epoch'] < epochs and not state['stopped']:
+            start_time = time.time()
+            epoch_loss = 0.0
+            epoch_count = 0
+
+            self.train()
+            for cur_x, cur_y in train_loader:
+                loss = criterion(self(cur_x), cur_y)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                epoch_loss += loss.item()
+                epoch_count += len(cur_y)
+
+            metrics = {'epoch': state['epoch'], 'train_loss': epoch_loss / epoch_count}
+            if val_loader is not None:
+                metrics['val_loss'], metrics['val_acc'] = self.evaluate_model(None, val_loader, 1)
+            monitored_loss = metrics.get('val_loss', metrics['train_loss'])
+
+            if monitored_loss < state['best_loss']:
+                state['best_loss'], state['best_epoch'] = monitored_loss, state['epoch']
+                best_weights = copy.deepcopy(self.state_dict())
+            state['stopped'] = patience is not None and state['epoch'] - state['best_epoch'] >= patience
+            state['epoch'] += 1
+
+            metrics.update(best_epoch=state['best_epoch'], stopped=state['stopped'], time=time.time() - start_time)
+            history.append(metrics)
+            if log_path is not None:
+                with open(log_path, 'a') as file:
+                    file.write(json.dumps(metrics) + '\n')
+            if checkpoint_path is not None:
+                checkpoint = {'model': self.state_dict(), 'optimizer': optimizer.state_dict(),
+                              'best_model': best_weights, 'state': state}
+                torch.save(checkpoint, checkpoint_path + '.tmp')
+                os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+        self.load_state_dict(best_weights)
+        return history
+
+    def predict_proba(self, dataset, batch_size=65536):
+        """ return the [N, 3] treatment probabilities of all the samples of a ListsDataset, as a numpy array """
+        self.eval()
+        probabilities = []
+        with torch.inference_mode():
+            for start in range(0, len(dataset), batch_size):
+                x, _ = dataset[start:start + batch_size]
+                probabilities.append(torch.softmax(self(x), dim=-1))
+        return torch.cat(probabilities).numpy()
+
     def evaluate_model(self, labels_weight, test_loader, c_epoch):
         self.eval()
         # criterion = nn.CrossEntropyLoss(reduction='sum', weight=labels_weight)
@@ -166,16 +285,187 @@ class TreatmentPrediction(nn.Module):
         return avg_loss, accuracy
 
 
+class FusedTreatmentPrediction(TreatmentPrediction):
+    """
+    TreatmentPrediction with its categorical lookups fused: fc1 is folded into the embeddings, so every category
+    row holds its contribution to the fc1 output and the 8 lookups + cat + fc1 become a single EmbeddingBag sum over
+    one offset-indexed table (torch.jit.script-able).
+    built from a TreatmentPrediction it computes the same function; trained on its own, every feature gets its own
+    rows (caller position and flop potential don't share the raiser position / hand potential tables)
+    """
+
+    # number of rows of every categorical feature, by ListsDataset.features order (checked_to excluded)
+    TABLE_SIZES = [6, 6, 196, 10, 4, 16, 16, 10]
+    CATEGORICAL = [0, 1, 3, 4, 5, 6, 7, 8]
+
+    def __init__(self, module=None):
+        nn.Module.__init__(self)  # reuse the methods of TreatmentPrediction, not its layers
+        module = module or TreatmentPrediction()
+        tables = [module.raiser_pos_embedding, module.raiser_pos_embedding, module.hand_embedding,
+                  module.hand_strength_embedding, module.flop_strength_embedding, module.hand_potential_embedding,
+                  module.hand_potential_embedding, module.order_embedding]
+
+        # fc1 input layout: checked_to, then the embeddings by 'tables' order
+        fc1_weight, fc1_slices, start = module.fc1.weight.detach(), [], 1
+        for table in tables:
+            fc1_slices.append(fc1_weight[:, start:start + table.embedding_dim])
+            start += table.embedding_dim
+
+        offsets = np.cumsum([0] + self.TABLE_SIZES[:-1])
+        self.register_buffer('offsets', torch.as_tensor(offsets, dtype=torch.int64).unsqueeze(-1))
+        self.register_buffer('categorical', torch.as_tensor(self.CATEGORICAL, dtype=torch.int64))
+        self.embedding = nn.EmbeddingBag(sum(self.TABLE_SIZES), module.fc1.out_features, mode='sum')
+        self.checked_to_weight = nn.Parameter(fc1_weight[:, 0].clone())
+        self.bias = nn.Parameter(module.fc1.bias.detach().clone())
+        with torch.no_grad():
+            for offset, size, table, fc1_slice in zip(offsets, self.TABLE_SIZES, tables, fc1_slices):
+                self.embedding.weight[offset:offset + size] = table.weight[:size] @ fc1_slice.T
+
+        self.dropout = nn.Dropout(module.dropout.p)
+        self.fc2 = copy.deepcopy(module.fc2)
+
+    def forward(self, x):
+        # x is [9] or [9, B]
+        single = x.dim() == 1
+        if single:
+            x = x.unsqueeze(-1)
+
+        indices = x.index_select(0, self.categorical) + self.offsets
+        out = self.embedding(indices.t()) + x[2].unsqueeze(-1).float() * self.checked_to_weight + self.bias
+
+        out = torch.relu(out)
+        out = self.dropout(out)
+        out = self.fc2(out)
+        return out.squeeze(0) if single else out
+
+
+class TabularPropensity:
+    """
+    exact alternative to TreatmentPrediction: P(T | X) is the empirical treatments distribution of the samples with
+    the same features, smoothed toward coarser and coarser feature subsets ('levels') - at every level
+    P(T | x) = (counts(x, T) + alpha * P_parent(T | x)) / (count(x) + alpha), down to the (add alpha) marginal P(T).
+    a level is skipped (P(T | x) = P_parent(T | x)) where its cell of x has less than min_count (weighted) samples,
+    so a sample never gets the propensity of a handful of (bootstrap resampled) rows.
+    counts are kept in a sorted table of mixed radix feature keys, so fitting is a single pass over the data
+    """
+
+    # feature names and number of values, by ListsDataset.features order
+    FEATURES = ['raiser_position', 'caller_position', 'checked_to', 'hands', 'hands_strength', 'flops_strength',
+                'hands_potential', 'flops_potential', 'cards_order']
+    FEATURE_SIZES = [6, 6, 2, 196, 10, 4, 16, 16, 10]
+
+    # from the finest to the coarsest. the finer levels (e.g. with 'hands', 196 values) put almost every sample in a
+    # cell of its own, the finest one here has 165 cells on 939 samples (the median sample shares its cell with 13)
+    DEFAULT_LEVELS = [['hands_strength', 'flops_strength', 'hands_potential', 'cards_order'],
+                      ['hands_strength', 'flops_strength', 'hands_potential'],
+                      ['hands_strength', 'flops_strength'],
+                      ['hands_strength']]
+
+    def __init__(self, levels=None, alpha=10.0, min_count=30, nof_treatments=3):
+        self.levels = [list(level) for level in (levels if levels is not None else self.DEFAULT_LEVELS)]
+        self.alpha = alpha
+        self.min_count = min_count
+        self.nof_treatments = nof_treatments
+        self.prior = None
+        self.tables = []  # per level: (sorted keys, [U, nof_treatments] counts)
+
+    def _keys(self, features, level):
+        keys = np.zeros(features.shape[1], dtype=np.int64)
+        for name in level:
+            idx = self.FEATURES.index(name)
+            keys = keys * self.FEATURE_SIZES[idx] + features[idx]
+        return keys
+
+    @staticmethod
+    def _features(data):
+        features = data.features if isinstance(data, ListsDataset) else data
+        return np.asarray(features, dtype=np.int64)
+
+    def fit(self, data, treatments=None, sample_weights=None):
+        """
+        :param data: a ListsDataset (its treatments are used if 'treatments' is None) or a [9, N] features array
+        :param sample_weights: [N] weight of every sample (e.g. bootstrap counts or weights)
+        """
+        features = self._features(data)
+        if treatments is None:
+            treatments = data.treatment_
+        treatments = np.asarray(treatments, dtype=np.int64)
+        if ((features < 0) | (features >= np.array(self.FEATURE_SIZES)[:, None])).any():
+            raise ValueError("features out of range of FEATURE_SIZES")
+
+        self.prior = np.bincount(treatments, weights=sample_weights, minlength=self.nof_treatments) + float(self.alpha)
+        self.prior /= self.prior.sum()
+
+        self.tables = []
+        for level in self.levels:
+            keys, inverse = np.unique(self._keys(features, level), return_inverse=True)
+            counts = np.bincount(inverse * self.nof_treatments + treatments, weights=sample_weights,
+                                 minlength=len(keys) * self.nof_treatments).reshape(len(keys), self.nof_treatments)
+            self.tables.append((keys, counts))
+        return self
+
+    def predict_proba(self, data):
+        """ return the [N, nof_treatments] treatment probabilities, same as TreatmentPrediction.predict_proba """
+        features = self._features(data)
+        probabilities = np.broadcast_to(self.prior, (features.shape[1], self.nof_treatments))
+
+        for level, (keys, counts) in reversed(list(zip(self.levels, self.tables))):
+            level_keys = self._keys(features, level)
+            positions = np.minimum(np.searchsorted(keys, level_keys), len(keys) - 1)
+            found = (keys[positions] == level_keys) & (counts[positions].sum(axis=1) >= self.min_count)
+            cell_counts = np.where(found[:, None], counts[positions], 0)
+            probabilities = ((cell_counts + self.alpha * probabilities) /
+                             (cell_counts.sum(axis=1, keepdims=True) + self.alpha))
+        return probabilities
+
+
+def ipw_estimate(propensities, treatments, outcomes, normalized=True, max_weight=None, nof_outcomes=3,
+                 sample_weights=None):
+    """
+    IPW estimate of P(Y=y | do(T=t)) for every treatment and outcome, in a single pass over the data.
+    :param propensities: [N, nof_treatments] P(T | X) of each sample (e.g. TreatmentPrediction.predict_proba)
+    :param normalized: Hajek estimator (weights normalized per treatment) if True, Horvitz-Thompson (divided by N)
+    otherwise
+    :param max_weight: clip the inverse propensity weights to this value
+    :param sample_weights: [N] weight of each sample (e.g. weighted bootstrap weights), 1 for all if None
+    :return: pr_y_t dict, pr_y_t['T=t']['Outcome=y']
+    """
+    propensities = np.asarray(propensities, dtype=np.float64)
+    treatments = np.asarray(treatments, dtype=np.int64)
+    outcomes = np.asarray(outcomes, dtype=np.int64)
+    nof_treatments = propensities.shape[1]
+
+    weights = 1 / propensities[np.arange(len(treatments)), treatments]
+    if max_weight is not None:
+        weights = np.minimum(weights, max_weight)
+    if sample_weights is not None:
+        weights = weights * np.asarray(sample_weights, dtype=np.float64)
+
+    # weights sum of every (treatment, outcome) cell
+    cells = np.bincount(treatments * nof_outcomes + outcomes, weights=weights,
+                        minlength=nof_treatments * nof_outcomes).reshape(nof_treatments, nof_outcomes)
+    if normalized:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table = cells / cells.sum(axis=1, keepdims=True)
+    else:
+        table = cells / (len(treatments) if sample_weights is None else np.sum(sample_weights))
+
+    return {f"T={t}": {f"Outcome={y}": table[t, y].item() for y in range(nof_outcomes)} for t in range(nof_treatments)}
+
+
 if __name__ == '__main__':
 
-    with open('data/lists_data.pkl', 'rb') as file:
-        all_lists = pickle.load(file)
+    if os.path.isdir('data/train_data'):
+        columns = load_columns('data/train_data')
+    else:
+        with open('data/lists_data.pkl', 'rb') as file:
+            columns = dict(zip(TRAIN_COLUMNS, pickle.load(file)))
 
     # op 1
-    treatments = [0 if v < 0.48 else (1 if v < 0.52 else 2) for v in all_lists[0]]
+    treatments = [0 if v < 0.48 else (1 if v < 0.52 else 2) for v in columns['treatment']]
     # # op 2
     # treatments = []
-    # for v in all_lists[0]:
+    # for v in columns['treatment']:
     #     if v < 0.45:
     #         treatments.append(0)
     #     elif v < 0.55:
@@ -185,72 +475,16 @@ if __name__ == '__main__':
     #     else:
     #         treatments.append(3)
     # op 3
-    # treatments = [int(v*10 - 3) for v in all_lists[0]]
+    # treatments = [int(v*10 - 3) for v in columns['treatment']]
     # treatments = [v if v >= 0 else 0 for v in treatments]
 
 
-    outcomes = all_lists[1]
-    raiser_position = all_lists[2]
-    caller_position = all_lists[3]
-    checked_to = all_lists[8]
-    hands, hands_strength, flops_strength, hands_potential, flops_potential = all_lists[9:-2]
-    cards_order = all_lists[-2]
-
-    dataset = ListsDataset(raiser_position, caller_position, checked_to, hands,
-                           hands_strength, flops_strength, hands_potential, flops_potential, cards_order,
-                           treatments)
-    dataset_size = len(dataset)
-
-
-    final_res = []
+    outcomes = columns['outcomes']
 
-    for _ in tqdm(range(1)):  # 1000
+    from bootstrap import run_bootstrap
 
-        num_epochs = 10
-        batch_size = 10
-
-        sampler = RandomSampler(dataset, replacement=True, num_samples=dataset_size)
-        dataloader = DataLoader(dataset, sampler=sampler, batch_size=batch_size)
-
-        model = TreatmentPrediction()
-        model.train_model(None, dataloader, None, epochs=num_epochs)
-
-        torch.save(model.state_dict(), 'treatment_prediction_model.pth')
-
-        probabilities = []
-        reals = []
-        for i in range(dataset_size):
-            x, t = dataset[i]
-            x = [torch.tensor(f) for f in x]
-            with torch.no_grad():
-                logits = model(x)
-                probs = torch.softmax(logits, dim=0).tolist()
-                probabilities.append(probs)
-                reals.append(t)
-        # __________
-
-        ws = []
-        for i in range(dataset_size):
-            wi = 1 / probabilities[i][reals[i]]
-            ws.append(wi)
-        # ______
-
-        pr_y_t = {'T=0': {'Outcome=0': 0, 'Outcome=1': 0, 'Outcome=2': 0},
-                  'T=1': {'Outcome=0': 0, 'Outcome=1': 0, 'Outcome=2': 0},
-                  'T=2': {'Outcome=0': 0, 'Outcome=1': 0, 'Outcome=2': 0}}
-
-        for t in range(3):
-
-            cur_treatment_indices = [i for i in range(dataset_size) if treatments[i] == t]
-            den = sum([ws[i] for i in cur_treatment_indices])
-
-            for y in range(3):
-                cur_outcome_indices = [i for i in range(dataset_size) if outcomes[i] == y]
-                rel_indices = [i for i in range(dataset_size) if i in cur_outcome_indices and i in cur_treatment_indices]
-                num = sum([ws[i] for i in rel_indices])
-                pr_y_t[f"T={t}"][f"Outcome={y}"] = num / den
-
-        final_res.append(pr_y_t)
+    final_res = run_bootstrap(columns, treatments, outcomes, nof_replicates=1000, results_dir='bootstrap_results',
+                              ensemble_size=50)
 
     with open("final_results.pkl", 'wb') as file:
         pickle.dump(final_res, file)
@@ -0,0 +1,108 @@
+import argparse
+import copy
+import os
+import pickle
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from IPW import FusedTreatmentPrediction, ListsDataset, RandomBatchSampler, TreatmentPrediction
+from train_store import TRAIN_COLUMNS, load_columns
+
+
+" Constants "
+
+MODELS = {'original': TreatmentPrediction, 'fused': FusedTreatmentPrediction}
+
+
+" Auxiliary Methods "
+
+
+def load_dataset(path):
+    """ the treatment dataset of a columnar store or a lists_data.pkl, with the IPW.py 'op 1' treatments """
+    if os.path.isdir(path):
+        columns = load_columns(path)
+    else:
+        with open(path, 'rb') as file:
+            columns = dict(zip(TRAIN_COLUMNS, pickle.load(file)))
+    treatments = np.digitize(np.asarray(columns['treatment']), [0.48, 0.52])
+    return ListsDataset.from_columns(columns, treatments)
+
+
+def subset(dataset, indices):
+    """ a ListsDataset of some rows of 'dataset' (e.g. the data tiled up to a benchmark size) """
+    indices = torch.as_tensor(indices, dtype=torch.int64)
+    return ListsDataset(*dataset.features[:, indices], dataset.treatment_[indices])
+
+
+def time_inference(model, dataset):
+    model.predict_proba(subset(dataset, range(100)))  # warm up
+    start_time = time.time()
+    model.predict_proba(dataset)
+    return time.time() - start_time
+
+
+def time_training(model, dataset, batch_size, seed=0):
+    warm_up_data = subset(dataset, range(10 * batch_size))
+    copy.deepcopy(model).fit(DataLoader(warm_up_data, sampler=RandomBatchSampler(len(warm_up_data), batch_size),
+                                        batch_size=None), epochs=1)
+    sampler = RandomBatchSampler(len(dataset), batch_size, generator=torch.Generator().manual_seed(seed))
+    start_time = time.time()
+    model.fit(DataLoader(dataset, sampler=sampler, batch_size=None), epochs=1)
+    return time.time() - start_time
+
+
+def held_out_metrics(model_class, dataset, seed, epochs, batch_size, test_fraction=0.2):
+    """ train a model on a random split of 'dataset' and return its (accuracy, cross entropy) on the rest """
+    permutation = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(seed))
+    nof_test = int(test_fraction * len(dataset))
+    train_data, test_data = subset(dataset, permutation[nof_test:]), subset(dataset, permutation[:nof_test])
+
+    torch.manual_seed(seed)
+    model = model_class()
+    sampler = RandomBatchSampler(len(train_data), batch_size, generator=torch.Generator().manual_seed(seed))
+    model.fit(DataLoader(train_data, sampler=sampler, batch_size=None), epochs=epochs)
+
+    probabilities = model.predict_proba(test_data)
+    treatments = test_data.treatment_.numpy()
+    accuracy = np.mean(probabilities.argmax(axis=1) == treatments)
+    cross_entropy = -np.mean(np.log(probabilities[np.arange(len(treatments)), treatments]))
+    return accuracy, cross_entropy
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="benchmark FusedTreatmentPrediction against TreatmentPrediction")
+    parser.add_argument('data', nargs='?', default='data/train_data', help="columnar store or lists_data.pkl")
+    parser.add_argument('--inference-rows', type=int, default=500000, help="rows (the data tiled) to predict")
+    parser.add_argument('--train-rows', type=int, default=200000, help="rows (the data tiled) of a training epoch")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--seeds', type=int, default=5, help="held-out accuracy is averaged over this many splits")
+    parser.add_argument('--epochs', type=int, default=10, help="training epochs of the held-out accuracy models")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    dataset = load_dataset(args.data)
+
+    # the fused model built from an original one computes the same function
+    torch.manual_seed(0)
+    original = TreatmentPrediction().eval()
+    x, _ = dataset[:]
+    with torch.no_grad():
+        max_diff = (original(x) - FusedTreatmentPrediction(original).eval()(x)).abs().max().item()
+    print(f"max output difference of the fused copy of a model: {max_diff:.2e}")
+
+    inference_data = subset(dataset, torch.arange(args.inference_rows) % len(dataset))
+    train_data = subset(dataset, torch.arange(args.train_rows) % len(dataset))
+    for name, model_class in MODELS.items():
+        torch.manual_seed(0)
+        inference_time = time_inference(model_class(), inference_data)
+        torch.manual_seed(0)
+        training_time = time_training(model_class(), train_data, args.batch_size)
+        metrics = np.array([held_out_metrics(model_class, dataset, seed, args.epochs, args.batch_size)
+                            for seed in range(args.seeds)])
+        print(f"{name:8s} inference of {args.inference_rows} rows: {inference_time:.3f}s, "
+              f"training epoch of {args.train_rows} rows: {training_time:.2f}s, "
+              f"held-out accuracy: {metrics[:, 0].mean():.3f}, cross entropy: {metrics[:, 1].mean():.3f}")
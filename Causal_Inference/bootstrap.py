@@ -0,0 +1,296 @@
+import copy
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.func import functional_call, stack_module_state, vmap
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from IPW import ListsDataset, RandomBatchSampler, TabularPropensity, TreatmentPrediction, ipw_estimate
+
+
+" Constants "
+
+NUM_EPOCHS = 10
+BATCH_SIZE = 10
+
+WEIGHT_SCHEMES = ['poisson', 'dirichlet']
+BACKENDS = ['net', 'tabular']
+
+TABULAR_GROUP_SIZE = 100  # tabular replicates take milliseconds, send them to the workers in groups
+
+
+" Worker "
+
+# set once per worker process by _init_worker, so the data is not pickled again for every replicate
+_worker_data = {}
+
+
+def _init_worker(columns, treatments, outcomes, num_epochs, batch_size, weights_scheme=None, init_state=None,
+                 patience=None):
+    torch.set_num_threads(1)  # one replicate per core
+    _worker_data['dataset'] = ListsDataset.from_columns(columns, treatments)
+    _worker_data['treatments'] = np.asarray(treatments)
+    _worker_data['outcomes'] = np.asarray(outcomes)
+    _worker_data['num_epochs'] = num_epochs
+    _worker_data['batch_size'] = batch_size
+    _worker_data['weights_scheme'] = weights_scheme
+    _worker_data['init_state'] = init_state
+    _worker_data['patience'] = patience
+
+
+def run_replicate(task):
+    """ train a TreatmentPrediction on a resample of the data and return [(replicate index, pr_y_t)] """
+    (replicate, seed), = task
+    dataset = _worker_data['dataset']
+    dataset_size = len(dataset)
+
+    torch.manual_seed(seed)
+    generator = torch.Generator().manual_seed(seed)
+    sampler = RandomBatchSampler(dataset_size, _worker_data['batch_size'], num_samples=dataset_size,
+                                 replacement=True, generator=generator)
+    dataloader = DataLoader(dataset, sampler=sampler, batch_size=None)
+
+    model = TreatmentPrediction()
+    if _worker_data['patience'] is None:
+        model.train_model(None, dataloader, None, epochs=_worker_data['num_epochs'], verbose=False)
+    else:
+        # early stopping on the loss over the full data, which the propensities are estimated for
+        model.fit(dataloader, [dataset[:]], epochs=_worker_data['num_epochs'], patience=_worker_data['patience'])
+
+    probabilities = model.predict_proba(dataset)
+    return [(replicate, ipw_estimate(probabilities, _worker_data['treatments'], _worker_data['outcomes']))]
+
+
+def run_ensemble(task):
+    """ train the replicates of 'task' as one vmapped ensemble and return [(replicate index, pr_y_t), ...] """
+    replicates, seeds = zip(*task)
+    dataset = _worker_data['dataset']
+    ensemble = train_ensemble(dataset, seeds, _worker_data['num_epochs'], _worker_data['batch_size'])
+    probabilities = ensemble_predict_proba(ensemble, dataset)
+    return [(replicate, ipw_estimate(replicate_probabilities, _worker_data['treatments'], _worker_data['outcomes']))
+            for replicate, replicate_probabilities in zip(replicates, probabilities)]
+
+
+def run_weighted_ensemble(task):
+    """ weighted bootstrap version of run_ensemble, see train_weighted_ensemble """
+    replicates, seeds = zip(*task)
+    dataset = _worker_data['dataset']
+    weights = torch.stack([bootstrap_weights(len(dataset), _worker_data['weights_scheme'], seed) for seed in seeds])
+    ensemble = train_weighted_ensemble(dataset, seeds, weights, _worker_data['num_epochs'], _worker_data['batch_size'],
+                                       _worker_data['init_state'])
+    probabilities = ensemble_predict_proba(ensemble, dataset)
+    return [(replicate, ipw_estimate(replicate_probabilities, _worker_data['treatments'], _worker_data['outcomes']))
+            for replicate, replicate_probabilities in zip(replicates, probabilities)]
+
+
+def run_tabular(task):
+    """
+    TabularPropensity replicates: the table is fitted with the replicate's rows counts (resample) or weights
+    (weighted bootstrap)
+    """
+    dataset = _worker_data['dataset']
+    dataset_size = len(dataset)
+    results = []
+    for replicate, seed in task:
+        if _worker_data['weights_scheme'] is None:
+            indices = torch.randint(dataset_size, (dataset_size,), generator=torch.Generator().manual_seed(seed))
+            weights = np.bincount(indices.numpy(), minlength=dataset_size)
+        else:
+            weights = bootstrap_weights(dataset_size, _worker_data['weights_scheme'], seed).numpy()
+        model = TabularPropensity().fit(dataset, sample_weights=weights)
+        results.append((replicate, ipw_estimate(model.predict_proba(dataset), _worker_data['treatments'],
+                                                _worker_data['outcomes'])))
+    return results
+
+
+" Ensemble "
+
+
+def train_ensemble(dataset, seeds, num_epochs=NUM_EPOCHS, batch_size=BATCH_SIZE):
+    """
+    train one TreatmentPrediction per seed, all at once: the parameters of the K models are stacked over a leading
+    replicate dimension and every step runs them with vmap, each replicate on its own resampled batch.
+    each model is initialized and resampled exactly as in run_replicate (only dropout draws differ)
+    :return: (stacked params, stacked buffers, stateless base model)
+    """
+    models = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        models.append(TreatmentPrediction())
+    params, buffers = stack_module_state(models)
+    base_model = copy.deepcopy(models[0]).to('meta')
+    base_model.train()
+
+    def replicate_loss(replicate_params, replicate_buffers, x, y):
+        output = functional_call(base_model, (replicate_params, replicate_buffers), (x,))
+        return F.cross_entropy(output, y, reduction='sum')
+
+    ensemble_loss = vmap(replicate_loss, randomness='different')
+    optimizer = torch.optim.Adam(params.values(), lr=0.001)  # elementwise, so replicates stay independent
+    generators = [torch.Generator().manual_seed(seed) for seed in seeds]
+    dataset_size = len(dataset)
+
+    for _ in range(num_epochs):
+        indices = torch.stack([torch.randint(dataset_size, (dataset_size,), generator=g) for g in generators])
+        for batch_indices in indices.split(batch_size, dim=1):
+            x, y = dataset[batch_indices]  # [9, K, B], [K, B]
+            loss = ensemble_loss(params, buffers, x.transpose(0, 1), y).sum()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    return params, buffers, base_model
+
+
+def train_weighted_ensemble(dataset, seeds, weights, num_epochs=NUM_EPOCHS, batch_size=BATCH_SIZE, init_state=None):
+    """
+    weighted bootstrap: replicate k is trained over the fixed dataset with the per-row loss weights weights[k]
+    (see bootstrap_weights) instead of over a resample of it.
+    as all the replicates see the same rows in the same order, every batch of features is gathered once and shared
+    by the whole vmapped ensemble, and rows weighted 0 by all the replicates are never visited.
+    :param weights: [K, N] rows weights
+    :param init_state: a TreatmentPrediction state_dict (e.g. of the full-data model) to warm start every replicate
+    from, in which case a few epochs are usually enough
+    :return: same as train_ensemble
+    """
+    models = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        model = TreatmentPrediction()
+        if init_state is not None:
+            model.load_state_dict(init_state)
+        models.append(model)
+    params, buffers = stack_module_state(models)
+    base_model = copy.deepcopy(models[0]).to('meta')
+    base_model.train()
+
+    def replicate_loss(replicate_params, replicate_buffers, replicate_weights, x, y):
+        output = functional_call(base_model, (replicate_params, replicate_buffers), (x,))
+        return (replicate_weights * F.cross_entropy(output, y, reduction='none')).sum()
+
+    ensemble_loss = vmap(replicate_loss, in_dims=(0, 0, 0, None, None), randomness='different')
+    optimizer = torch.optim.Adam(params.values(), lr=0.001)
+    generator = torch.Generator().manual_seed(seeds[0])
+    weights = torch.as_tensor(weights, dtype=torch.float32)
+    rows = torch.nonzero(weights.sum(dim=0) > 0).squeeze(1)
+
+    for _ in range(num_epochs):
+        for batch_indices in rows[torch.randperm(len(rows), generator=generator)].split(batch_size):
+            x, y = dataset[batch_indices]
+            loss = ensemble_loss(params, buffers, weights[:, batch_indices], x, y).sum()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+    return params, buffers, base_model
+
+
+def ensemble_predict_proba(ensemble, dataset, batch_size=65536):
+    """ return the [K, N, 3] treatment probabilities of every replicate of a train_ensemble output """
+    params, buffers, base_model = ensemble
+    base_model.eval()
+
+    def replicate_proba(replicate_params, replicate_buffers, x):
+        return torch.softmax(functional_call(base_model, (replicate_params, replicate_buffers), (x,)), dim=-1)
+
+    ensemble_proba = vmap(replicate_proba, in_dims=(0, 0, None))
+    probabilities = []
+    with torch.no_grad():
+        for start in range(0, len(dataset), batch_size):
+            x, _ = dataset[start:start + batch_size]
+            probabilities.append(ensemble_proba(params, buffers, x))
+    return torch.cat(probabilities, dim=1).numpy()
+
+
+" Auxiliary Methods "
+
+
+def replicate_seeds(seed, nof_replicates):
+    """ independent seed of every replicate, the same whatever the worker that runs it """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(nof_replicates)]
+
+
+def bootstrap_weights(nof_rows, scheme, seed):
+    """
+    rows weights of a weighted bootstrap replicate, with mean 1:
+    'poisson' - Poisson(1) counts, the large sample equivalent of resampling with replacement
+    'dirichlet' - Bayesian bootstrap, N * Dirichlet(1, ..., 1)
+    """
+    generator = torch.Generator().manual_seed(seed)
+    if scheme == 'poisson':
+        return torch.poisson(torch.ones(nof_rows), generator=generator)
+    if scheme == 'dirichlet':
+        weights = torch.empty(nof_rows).exponential_(generator=generator)
+        return weights * nof_rows / weights.sum()
+    raise ValueError(f"unknown weights scheme '{scheme}', expected one of {WEIGHT_SCHEMES}")
+
+
+def replicate_path(results_dir, replicate):
+    return os.path.join(results_dir, f'replicate_{replicate:05d}.pkl')
+
+
+def _dump(obj, path):
+    """ write through a temporary file, so a crash never leaves a partial result behind """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(obj, file)
+    os.replace(tmp_path, path)
+
+
+def run_bootstrap(columns, treatments, outcomes, nof_replicates=1000, results_dir='bootstrap_results',
+                  processes=None, seed=0, num_epochs=NUM_EPOCHS, batch_size=BATCH_SIZE, ensemble_size=None,
+                  weights_scheme=None, init_state=None, patience=None, backend='net'):
+    """
+    run the IPW bootstrap, spreading the replicates across a process pool.
+    in every mode and backend, a replicate's resample or weights only change how its propensity model is trained,
+    and its pr_y_t is estimated over the full, unweighted data (as the original bootstrap loop did), so the CIs of
+    all the modes measure the same variability and can be compared.
+    every replicate's pr_y_t is written to 'results_dir' as soon as it's done, and replicates already there are
+    skipped, so a crashed run resumes where it stopped.
+    :param ensemble_size: train the replicates in vmapped ensembles of this size (see train_ensemble), one ensemble
+    per pool task, instead of one model per task
+    :param weights_scheme: None to resample the rows, or one of WEIGHT_SCHEMES for a weighted bootstrap (see
+    train_weighted_ensemble), in which case the replicates are always trained as ensembles
+    :param init_state: weighted bootstrap only, state_dict to warm start the replicates from
+    :param patience: single model replicates only, stop a replicate after this many epochs without improvement of
+    its loss over the full data (see TreatmentPrediction.fit), 'num_epochs' is then the maximal number of epochs
+    :param backend: 'net' for TreatmentPrediction propensities, 'tabular' for TabularPropensity ones (the training
+    parameters are then ignored)
+    (don't mix modes in the same 'results_dir', the saved replicates are reused whatever mode made them)
+    :return: the pr_y_t of all replicates, by replicate order (final_results.pkl structure)
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    seeds = replicate_seeds(seed, nof_replicates)
+    pending = [(i, seeds[i]) for i in range(nof_replicates) if not os.path.exists(replicate_path(results_dir, i))]
+
+    if pending:
+        if weights_scheme is not None and weights_scheme not in WEIGHT_SCHEMES:
+            raise ValueError(f"unknown weights scheme '{weights_scheme}', expected one of {WEIGHT_SCHEMES}")
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown backend '{backend}', expected one of {BACKENDS}")
+        group_size = ensemble_size or 1
+        if backend == 'tabular':
+            group_size, worker = TABULAR_GROUP_SIZE, run_tabular
+        elif weights_scheme is not None:
+            worker = run_weighted_ensemble
+        else:
+            worker = run_ensemble if ensemble_size else run_replicate
+        tasks = [pending[i:i + group_size] for i in range(0, len(pending), group_size)]
+
+        init_args = ({name: np.asarray(values) for name, values in columns.items()}, treatments, outcomes,
+                     num_epochs, batch_size, weights_scheme, init_state, patience)
+        with Pool(processes or os.cpu_count(), initializer=_init_worker, initargs=init_args) as pool:
+            for results in tqdm(pool.imap_unordered(worker, tasks), total=len(tasks)):
+                for replicate, pr_y_t in results:
+                    _dump(pr_y_t, replicate_path(results_dir, replicate))
+
+    final_res = []
+    for i in range(nof_replicates):
+        with open(replicate_path(results_dir, i), 'rb') as file:
+            final_res.append(pickle.load(file))
+    return final_res
@@ -0,0 +1,222 @@
+import argparse
+import itertools
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+
+from feature_cache import FeatureCache
+from feature_table import load_feature_table, table_featurize
+from hand_equity import SAMPLES, batch_hand_equity, top_range
+from hand_history import (PREFLOP, FLOP, END, FOLD, CALL, BET, RAISE, first_index, parse_rows, read_row_chunks,
+                          read_new_row_chunks)
+from train_store import MANIFEST, TRAIN_COLUMNS, append_columns, load_manifest, save_columns
+
+
+" Constants "
+
+BIG_BLIND = 0.02
+
+# cards features of the classes already seen by this process, shared by its chunks
+_FEATURE_CACHE = FeatureCache()
+_FEATURE_TABLES = {}  # path -> memory-mapped feature table, loaded once per process
+
+
+" Auxiliary Methods "
+
+
+def _featurize(hero_cards, flops, feature_table=None):
+    if feature_table is None:
+        return _FEATURE_CACHE.featurize(hero_cards, flops)
+    if feature_table not in _FEATURE_TABLES:
+        _FEATURE_TABLES[feature_table] = load_feature_table(feature_table)
+    return table_featurize(_FEATURE_TABLES[feature_table], hero_cards, flops)
+
+
+def extract_train_columns(chunk, big_blind=BIG_BLIND, equity=None, feature_table=None):
+    """
+    vectorized version of the processing.ipynb c-bet extraction + create_train_data.ipynb featurization,
+    over a chunk of relevant games (see hand_history.relevant_games_mask).
+    games missing one of the needed rows (no flop caller, no reply to the c-bet, ...) are dropped.
+    :param equity: if given, dict of hand_equity.batch_hand_equity parameters (villain_range, samples, ...) to add
+    a 'hands_equity' column with
+    :param feature_table: path of a feature_table.build_feature_table table to gather the cards features from
+    :return: dict of TRAIN_COLUMNS (+ 'hands_equity') -> array (None for an empty chunk)
+    """
+    if len(chunk) == 0:
+        return None
+
+    bb100 = big_blind * 100
+    nof_rows = len(chunk.action)
+    game_ends = chunk.offsets[1:]
+    game_of_rows = chunk.game_of_rows()
+    player = chunk.player.astype(np.int64)
+    preflop, flop = chunk.round == PREFLOP, chunk.round == FLOP
+
+    def at(column, rows):
+        return column[np.minimum(rows, nof_rows - 1)]
+
+    # preflop raiser & the first preflop caller who saw the flop
+    raise_row = first_index(chunk, preflop & (chunk.action == RAISE))
+    raiser = at(player, raise_row)
+    flop_players = np.bitwise_or.reduceat(np.where(flop, np.left_shift(1, player), 0), chunk.offsets[:-1])
+    saw_flop = (flop_players[game_of_rows] >> player) & 1 == 1
+    caller_row = first_index(chunk, preflop & (chunk.action == CALL) & saw_flop)
+    caller = at(player, caller_row)
+
+    raiser_stack_row = first_index(chunk, preflop & (player == raiser[game_of_rows]))
+    caller_stack_row = first_index(chunk, preflop & (player == caller[game_of_rows]))
+
+    # c-bet, its reply and the raiser's result
+    cbet_row = first_index(chunk, flop & (chunk.action == BET))
+    respond_row = cbet_row + 1
+    profit_row = first_index(chunk, (chunk.round == END) & (player == raiser[game_of_rows]))
+
+    valid = ((raise_row < game_ends) & (caller_row < game_ends) & (cbet_row < game_ends) &
+             (respond_row < game_ends) & (profit_row < game_ends))
+
+    bet_value, pot_value = at(chunk.actions_detail, cbet_row), at(chunk.pot, cbet_row)
+    respond_action = at(chunk.action, respond_row)
+    raiser_position = at(chunk.position, cbet_row).astype(np.int64)
+    caller_position = at(chunk.position, respond_row).astype(np.int64)
+
+    hands, hands_strength, flops_strength, hands_potential, flops_potential, cards_order = _featurize(
+        chunk.hero_cards[valid], chunk.flops[valid], feature_table)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = (bet_value / pot_value)[valid]
+
+    columns = {
+        'treatment': np.array([round(v, 1) for v in ratios.tolist()]),  # python's round, as in the notebook
+        'outcomes': np.where(respond_action == FOLD, 0, np.where(respond_action == CALL, 1, 2))[valid],
+        'raiser_position': raiser_position[valid],
+        'caller_position': caller_position[valid],
+        'open_sizes': at(chunk.actions_detail, raise_row)[valid] / bb100,
+        'raiser_stack': at(chunk.stack, raiser_stack_row)[valid] / bb100,
+        'caller_stack': at(chunk.stack, caller_stack_row)[valid] / bb100,
+        'pot_size': pot_value[valid] / bb100,
+        'checked_to': (raiser_position > caller_position).astype(np.int64)[valid],
+        'hands': hands,
+        'hands_strength': hands_strength,
+        'flops_strength': flops_strength,
+        'hands_potential': hands_potential,
+        'flops_potential': flops_potential,
+        'cards_order': cards_order,
+        'profits': at(chunk.actions_detail, profit_row)[valid] / bb100,
+    }
+    if equity is not None:
+        columns['hands_equity'] = batch_hand_equity(chunk.hero_cards[valid], chunk.flops[valid], processes=1, **equity)
+    return columns
+
+
+def process_rows(task):
+    """ pool worker: parse, filter, extract and featurize one chunk of raw csv rows """
+    header, rows, big_blind, equity, feature_table = task
+    return extract_train_columns(parse_rows(rows, header, only_relevant=True), big_blind, equity, feature_table)
+
+
+def build_train_columns(paths, processes=None, chunk_size=10000, big_blind=BIG_BLIND, equity=None,
+                        feature_table=None):
+    """
+    build the train columns out of the given csv files, sharding their chunks across a process pool.
+    results are merged by (file, chunk) order, so the output is the same as running the notebooks on the
+    concatenation of the files, whatever the number of processes
+    :param equity: see extract_train_columns (every worker caches the equity of the classes it has seen)
+    :param feature_table: see extract_train_columns
+    """
+    row_chunks = (row_chunk for path in paths for row_chunk in read_row_chunks(path, chunk_size))
+    return _build_columns(row_chunks, processes, big_blind, equity, feature_table)
+
+
+def append_train_data(directory, paths, processes=None, chunk_size=10000, big_blind=BIG_BLIND, equity=None,
+                      feature_table=None, rebuild=False):
+    """
+    incremental build_train_columns into a columnar store: only the rows of 'paths' that were not ingested yet
+    (new files, or rows appended to ingested files) are parsed and featurized, and their games are appended to the
+    store. sources are identified by their real absolute path and recorded (see read_new_row_chunks) in the store's
+    metadata, atomically with the appended rows
+    :param rebuild: ignore the store content and rebuild it from scratch out of 'paths'
+    :return: number of appended games
+    """
+    keys = [os.path.realpath(path) for path in paths]
+    if len(set(keys)) < len(keys):
+        raise ValueError(f"the same file is given more than once: {paths}")
+
+    exists = not rebuild and os.path.exists(os.path.join(directory, MANIFEST))
+    sources = load_manifest(directory)['metadata'].get('sources', {}) if exists else {}
+    if not all(os.path.isabs(key) for key in sources):
+        raise RuntimeError(f"{directory} records its sources by file name, rebuild the train data")
+    records = {key: dict(sources.get(key, {})) for key in keys}
+
+    row_chunks = (row_chunk for path, key in zip(paths, keys)
+                  for row_chunk in read_new_row_chunks(path, records[key], chunk_size))
+    train_columns = _build_columns(row_chunks, processes, big_blind, equity, feature_table)
+
+    sources.update(records)
+    if exists:
+        append_columns(directory, train_columns, metadata={'sources': sources})
+    else:
+        save_columns(directory, train_columns, metadata={'sources': sources})
+    return len(train_columns['treatment'])
+
+
+def _build_columns(row_chunks, processes, big_blind, equity, feature_table):
+    processes = processes or os.cpu_count()
+    tasks = ((header, rows, big_blind, equity, feature_table) for header, rows in row_chunks)
+
+    results = []
+    with Pool(processes) as pool:
+        # feed the pool a bounded window of chunks at a time, so raw rows never pile up in memory
+        while True:
+            window = list(itertools.islice(tasks, 4 * processes))
+            if not window:
+                break
+            results.extend(pool.map(process_rows, window))
+
+    results = [result for result in results if result is not None]
+    names = TRAIN_COLUMNS + (['hands_equity'] if equity is not None else [])
+    if not results:
+        return {name: np.empty(0) for name in names}
+    return {name: np.concatenate([result[name] for result in results]) for name in names}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="build the train lists (lists_data.pkl) from raw hand histories")
+    parser.add_argument('paths', nargs='+', help="hand histories csv files, by order (e.g. new.csv old.csv rush.csv)")
+    parser.add_argument('-o', '--output', default='data/lists_data.pkl',
+                        help="a .pkl path for the pickled all_lists, otherwise a directory for a columnar store")
+    parser.add_argument('-p', '--processes', type=int, default=None, help="default: number of cpus")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="games per shard")
+    parser.add_argument('--big-blind', type=float, default=BIG_BLIND)
+    parser.add_argument('--equity', action='store_true', help="add a 'hands_equity' column")
+    parser.add_argument('--equity-range', type=float, default=None,
+                        help="villain range as a top fraction of the starting hands (default: any two cards)")
+    parser.add_argument('--equity-samples', type=int, default=SAMPLES,
+                        help="Monte Carlo runouts per (hand, flop) class, 0 to enumerate all of them")
+    parser.add_argument('--feature-table', default=None,
+                        help="gather the cards features from this table (see feature_table.py)")
+    parser.add_argument('--append', action='store_true',
+                        help="only ingest the games not ingested yet and append them to the output columnar store, "
+                             "instead of rebuilding it")
+    args = parser.parse_args()
+
+    equity = None
+    if args.equity:
+        equity = {'villain_range': None if args.equity_range is None else top_range(args.equity_range),
+                  'samples': args.equity_samples or None}
+    if args.output.endswith('.pkl'):
+        if args.append:
+            parser.error("--append needs a columnar store output")
+        train_columns = build_train_columns(args.paths, args.processes, args.chunk_size, args.big_blind, equity,
+                                            args.feature_table)
+        # extra columns (hands_equity) come after the TRAIN_COLUMNS lists
+        all_lists = [values.tolist() for values in train_columns.values()]
+        with open(args.output, 'wb') as file:
+            pickle.dump(all_lists, file)
+        print(f"{len(train_columns['treatment'])} games saved to {args.output}")
+    else:
+        nof_games = append_train_data(args.output, args.paths, args.processes, args.chunk_size, args.big_blind, equity,
+                                      args.feature_table, rebuild=not args.append)
+        print(f"{nof_games} {'new games appended' if args.append else 'games saved'} to {args.output}")
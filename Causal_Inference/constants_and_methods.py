@@ -1,5 +1,6 @@
 from collections import Counter
-import copy
+
+import numpy as np
 
 
 " Constants "
@@ -10,6 +11,8 @@ J, Q, K, A = 11, 12, 13, 14
 RANKS = [2, 3, 4, 5, 6, 7, 8, 9, 10, J, Q, K, A]
 
 SUIT_MAPPER = {'d': '♦', 'c': '♣', 'h': '♥', 's': '♠'}
+RANK_CHARS = '23456789TJQKA'
+VALUE_MAPPER = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, 'T': 10, 'J': J, 'Q': Q, 'K': K, 'A': A}
 
 ROYAL_FLUSH = 9
 STRAIGHT_FLUSH = 8
@@ -37,26 +40,42 @@ STARTING_HANDS_RANKING = [
 
 FLOP_ORDER_HASH = {tup: idx for idx, tup in enumerate((i, j) for i in range(4) for j in range(i, 4))}
 
+SUIT_INDEX = {suit: idx for idx, suit in enumerate(SUITS)}
+WHEEL_MASK = 1 << (A - 2) | 0b1111  # A2345
+
 
 " Auxiliary Classes "
 
 
 class Card:
-    """ represent a card in the deck """
+    """ represent a card in the deck, stored as its integer code (see card_to_code) """
+
+    __slots__ = ('code',)
+
+    suit_mapper = {'♦': 'd', '♣': 'c', '♥': 'h', '♠': 's'}
 
     def __init__(self, value: int, suit: str):
-        # card attributes
-        self.value = value
-        self.suit = suit
+        self.code = (value - 2) * 4 + SUIT_INDEX[suit]
+
+    @classmethod
+    def from_code(cls, code: int):
+        card = cls.__new__(cls)
+        card.code = code
+        return card
+
+    @property
+    def value(self):
+        return (self.code >> 2) + 2
+
+    @property
+    def suit(self):
+        return SUITS[self.code & 3]
 
-        mapper = {14: 'A', 13: 'K', 12: 'Q', 11: 'J', 10: 'T'}
-        self.str_value = str(value) if value<10 else mapper[value]
-        self.suit_mapper = {'♦': 'd', '♣': 'c', '♥': 'h', '♠': 's'}
+    @property
+    def str_value(self):
+        return RANK_CHARS[self.code >> 2]
 
     def __repr__(self):
-        # card_value = str(self.value) if self.value not in self.mapper else self.mapper[self.value]
-        # card_value = str(self.value) if self.value not in self.mapper else self.mapper[self.value]
-        # card_suit = self.suit
         return self.str_value + self.suit
 
     def get_card_rep(self):
@@ -64,17 +83,18 @@ class Card:
         pass
 
     def get_card_str_rep(self):
-        # return str(self.value) + self.suit_mapper[self.suit]  # changed it for HP model
         return self.str_value + self.suit_mapper[self.suit]
 
+    def __index__(self):
+        return self.code
+
     def __eq__(self, other):
         if isinstance(other, Card):
-            return self.value == other.value and self.suit == other.suit
+            return self.code == other.code
         return False
 
     def __hash__(self):
-        # Combine value and suit into a tuple for hashing
-        return hash((self.value, self.suit))
+        return hash(self.code)
 
 
 class FinalHand:
@@ -94,224 +114,130 @@ class FinalHand:
 " Auxiliary Methods "
 
 
-def evaluate_hand(cards_to_check):
-    """ return the best hand possible out of this cards """
+def card_to_code(card):
+    """
+    map a card into its integer code in [0, 52) (rank-major: 4 * (value - 2) + suit index).
+    accept either a Card or an already compact code
+    """
+    return int(card)
+
+
+def card_str_to_code(card_str):
+    """ map a card string (e.g. 'Tc') into its integer code """
+    return (VALUE_MAPPER[card_str[0]] - 2) * 4 + SUIT_INDEX[SUIT_MAPPER[card_str[1]]]
+
+
+def _straight_top(ranks_mask):
+    """ return the top value of the best straight in a 13-bit ranks mask (0 if there is none) """
+    for top in range(A, 5, -1):
+        straight_mask = 0b11111 << (top - 6)
+        if ranks_mask & straight_mask == straight_mask:
+            return top
+    if ranks_mask & WHEEL_MASK == WHEEL_MASK:
+        return 5
+    return 0
+
+
+def _evaluate_rank_key(key):
+    """ evaluate a (non-flush) multiset of ranks, encoded with one base-5 digit (count) per rank """
+    counts = {}
+    for value in RANKS:
+        if key % 5:
+            counts[value] = key % 5
+        key //= 5
+    values = sorted(counts, reverse=True)  # distinct values, high to low
+
+    quads = [v for v in values if counts[v] == 4]
+    same_3 = [v for v in values if counts[v] == 3]
+    same_2 = [v for v in values if counts[v] == 2]
+
+    if quads:
+        kicker = max([v for v in values if v != quads[0]], default=0)
+        return FOUR_OF_A_KIND, quads[0], (kicker,)
 
-    def get_suites(arr):
-        " return the name of the suits with  at least 5 cards "
-        count = {s: 0 for s in SUITS}
-        for card in arr:
-            count[card.suit] += 1
-        for suit_key in count:
-            if count[suit_key] >= 5:
-                return suit_key
-        return None
-
-    def is_increasing(arr):
-        """ check for 5 consecutive increasing cards (e.g. 12345)"""
-        for i in range(len(arr) - 1):
-            if arr[i].value != arr[i + 1].value - 1:
-                return False
-        return True
-
-    def all_suited(arr):
-        """ check if all cards in 'arr' has the same suit"""
-        pos_suit = arr[-1].suit
-        for inst in arr:
-            if inst.suit != pos_suit:
-                return False
-        return True
-
-    # sort cards
-    cards_to_check.sort(key=lambda inst: inst.value)
-
-    # save only cards values
-    cards_nums = [card.value for card in cards_to_check]
-
-    # save cards counts
-    counts = Counter(cards_nums)
-
-    # ______________________________________________________________________________________________
-
-    """ check for straight & Royal Flush / Straight Flush"""
-    # stop and return only if got royal flush /straight flush
-
-    got_straight = False
-    royal_flag = False
-    straight = {'rank': 0}
-    royal_straight = {'rank': 0}
-
-    # create copy of the cards and remove duplicates (cards with same value number)
-    cards_copy = copy.deepcopy(cards_to_check)
-    flush_pos_suit = get_suites(cards_copy)
-    duplicated_indices = []
-    for i in range(1, len(cards_copy)):
-        if cards_copy[i - 1].value == cards_copy[i].value:
-            duplicated_indices.append(i)
-    duplicated_indices.reverse()
-    for i in duplicated_indices:
-        del cards_copy[i]
-
-    # when duplicate were removed, keep the duplicate with a suit that can create royal/straight flush
-    if len(cards_copy) >= 5 and flush_pos_suit:
-        for i in range(5):
-            cur_card = cards_copy[i]
-            new_card = Card(cur_card.value, flush_pos_suit)
-            if new_card in cards_to_check:
-                cards_copy[i] = new_card
-
-    # add A to the begging to represent 1 if needed
-    if cards_to_check[-1].value == A:
-        # cards_copy.insert(0, copy.copy(cards_to_check[-1]))
-        cards_copy.insert(0, Card(1, cards_to_check[-1].suit))
-
-    # check for straight
-    for i in range(len(cards_copy) - 4):
-        if is_increasing(cards_copy[i:i + 5]):
-            got_straight = True
-            straight['rank'] = max(straight['rank'], cards_copy[i + 4].value)
-
-            # check for flush + straight
-            if all_suited(cards_copy[i:i + 5]):
-                royal_flag = True
-                royal_straight['rank'] = max(royal_straight['rank'], cards_copy[i + 4].value)
-
-    if royal_flag is True:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=ROYAL_FLUSH,
-                         rank_size=royal_straight['rank'])
-
-    """ _____ check for 4 of a kind _____ """
-
-    got_4_of_kind = False
-    four_of_kind = {}
-
-    if len(counts.keys()) < 5:  # 4 of a kind is possible
-        for card_num in counts.keys():
-            if counts[card_num] == 4:
-                got_4_of_kind = True
-                four_of_kind['rank'] = card_num
-                break  # can't be another option
-
-        # find rank and kicker
-        if got_4_of_kind is True:
-            four_of_kind['kicker'] = 0
-            for card_num in counts.keys():
-                if card_num != four_of_kind['rank']:
-                    four_of_kind['kicker'] = max(four_of_kind['kicker'], card_num)
-
-    if got_4_of_kind is True:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=FOUR_OF_A_KIND,
-                         rank_size=four_of_kind['rank'], kickers=[four_of_kind['kicker']])
-
-    """ _____ check for FULL HOUSE & 3 OF A KIND & 2 PAIRS & 1 PAIR _____ """
-
-    got_full_house = False
-    full_house = {}
-
-    got_3_of_kind = False
-    three_of_kind = {}
-
-    got_2_pairs = False
-    two_pairs = {}
-
-    got_1_pair = False
-    one_pair = {}
-
-    same_3, same_2 = [], []
-    for card_num in counts.keys():
-        if counts[card_num] == 3:
-            same_3.append(card_num)
-        elif counts[card_num] == 2:
-            same_2.append(card_num)
-
-    # full house
     if len(same_3) == 2:
-        got_full_house = True
-        full_house['3'] = max(same_3)
-        full_house['2'] = min(same_3)
-    elif len(same_3) == 1 and len(same_2) >= 1:
-        got_full_house = True
-        full_house['3'] = max(same_3)
-        full_house['2'] = max(same_2)
-
-    if got_full_house:
-        full_house_rank = 13 * full_house['3'] + full_house['2']
-        return FinalHand(seven_cards=cards_to_check, hand_rank=FULL_HOUSE,
-                         rank_size=full_house_rank)
-
-    # 3 of a kind
-    if len(same_3) == 1:
-        got_3_of_kind = True
-        three_of_kind['rank'] = same_3[0]
-        # find kickers
-        pos_cards = sorted([c.value for c in cards_to_check if c.value != three_of_kind['rank']])
-        three_of_kind['kicker'] = pos_cards[-2:]
-
-    # two pairs
+        return FULL_HOUSE, 13 * same_3[0] + same_3[1], None
+    if len(same_3) == 1 and same_2:
+        return FULL_HOUSE, 13 * same_3[0] + same_2[0], None
+
+    top = STRAIGHT_TOP[sum(1 << (v - 2) for v in values)]
+    if top:
+        return STRAIGHT, top, None
+
+    if same_3:
+        return THREE_OF_A_KIND, same_3[0], tuple(v for v in values if v != same_3[0])[:2]
+
     if len(same_2) > 1:
-        got_2_pairs = True
-        two_pairs['rank'] = sorted(same_2)[-2:]
-        # find kickers
-        pos_cards = sorted([c.value for c in cards_to_check if c.value not in two_pairs['rank']])
-        two_pairs['kicker'] = pos_cards[-1]
+        kicker = max([v for v in values if v not in same_2[:2]], default=0)
+        return TWO_PAIR, 169 * same_2[0] + 13 * same_2[1], (kicker,)
 
-    # one pair
-    if len(same_2) == 1:
-        got_1_pair = True
-        one_pair['rank'] = same_2[0]
-        # find kickers
-        pos_cards = sorted([c.value for c in cards_to_check if c.value != one_pair['rank']])
-        one_pair['kicker'] = pos_cards[-3:]
+    if same_2:
+        return ONE_PAIR, same_2[0], tuple(v for v in values if v != same_2[0])[:3]
 
-    " _____________________ check for FLUSH _____________________ "
+    return HIGH_CARD, values[0], tuple(values[:5])
 
-    # check for flush po (5 suited cards)
-    suit_5plus = get_suites(cards_to_check)
 
-    got_flush = False
-    flush = {}
-    kickers = []
+def _evaluate_flush_mask(ranks_mask):
+    """ evaluate the cards of a suit with at least 5 cards, given as 13-bit ranks mask """
+    top = STRAIGHT_TOP[ranks_mask]
+    if top:
+        return ROYAL_FLUSH, top, None
+    values = [v for v in reversed(RANKS) if ranks_mask >> (v - 2) & 1]
+    return FLUSH, values[0], tuple(values)
 
-    if suit_5plus is not None:
-        got_flush = True
-        flush['rank'] = 0
-        for card in cards_to_check:
-            if card.suit == suit_5plus:
-                flush['rank'] = max(flush['rank'], card.value)
-                kickers.append(card.value)
 
-    if got_flush:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=FLUSH,
-                         rank_size=flush['rank'], kickers=sorted(kickers))
+def evaluate_codes(codes):
+    """
+    return (hand_rank, rank_size, kickers) of the best hand out of up to 7 card codes (see card_to_code).
+    flush hands are looked up by their suit's ranks mask, all other hands by a perfect hash of their ranks
+    multiset (one base-5 digit per rank), filled on first use. kickers are ordered high to low (as FinalHand's)
+    """
+    key = 0
+    suit_masks = [0, 0, 0, 0]
+    for code in codes:
+        key += _RANK_KEY[code]
+        suit_masks[code & 3] |= _RANK_BIT[code]
 
-    if got_straight:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=STRAIGHT,
-                         rank_size=straight['rank'])
+    if len(codes) >= 5:
+        for ranks_mask in suit_masks:
+            if ranks_mask in FLUSH_TABLE:
+                return FLUSH_TABLE[ranks_mask]
 
-    # _____________________ check for 3 OF A KIND / 2 PAIRS / 1 PAIR _____________________ "
+    result = _RANKS_TABLE.get(key)
+    if result is None:
+        result = _RANKS_TABLE[key] = _evaluate_rank_key(key)
+    return result
 
-    if got_3_of_kind:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=THREE_OF_A_KIND,
-                         rank_size=three_of_kind['rank'], kickers=three_of_kind['kicker'])
 
-    if got_2_pairs:
-        two_pairs_rank = 169 * two_pairs['rank'][1] + 13 * two_pairs['rank'][0]
-        return FinalHand(seven_cards=cards_to_check, hand_rank=TWO_PAIR,
-                         rank_size=two_pairs_rank, kickers=[two_pairs['kicker']])
+def evaluate_hand(cards_to_check):
+    """ return the best hand possible out of this cards """
+    cards_to_check.sort(key=lambda inst: card_to_code(inst) >> 2)
+    hand_rank, rank_size, kickers = evaluate_codes([card_to_code(card) for card in cards_to_check])
+    if kickers is not None:
+        kickers = list(reversed(kickers))  # FinalHand expects them low to high
+    return FinalHand(seven_cards=cards_to_check, hand_rank=hand_rank, rank_size=rank_size, kickers=kickers)
 
-    if got_1_pair:
-        return FinalHand(seven_cards=cards_to_check, hand_rank=ONE_PAIR,
-                         rank_size=one_pair['rank'], kickers=one_pair['kicker'])
 
-    return FinalHand(seven_cards=cards_to_check, hand_rank=HIGH_CARD,
-                     rank_size=max(list(counts.keys())), kickers=sorted(list(counts.keys()))[-5:])
+" Hand Evaluator Tables "
+
+# rank of the best straight for every 13-bit ranks mask
+STRAIGHT_TOP = [_straight_top(ranks_mask) for ranks_mask in range(1 << 13)]
+
+# straight flush / flush result for every ranks mask of a suit holding at least 5 cards
+FLUSH_TABLE = {ranks_mask: _evaluate_flush_mask(ranks_mask) for ranks_mask in range(1 << 13)
+               if bin(ranks_mask).count('1') >= 5}
+
+_RANK_KEY = [5 ** (code // 4) for code in range(52)]
+_RANK_BIT = [1 << (code // 4) for code in range(52)]
+_RANKS_TABLE = {}
 
 
 def expand_evaluate_hand(cards_to_check):
     """ return possible draws with given cards """
 
-    suits = [c.suit for c in cards_to_check]
-    values = [c.value for c in cards_to_check]
+    codes = [card_to_code(c) for c in cards_to_check]
+    suits = [code & 3 for code in codes]
+    values = [(code >> 2) + 2 for code in codes]
 
     flush_draw = False
     runner_flush_draw = False
@@ -349,17 +275,7 @@ def get_hand_equivalence_class(hand, type_='Card'):
 
     card_1, card_2 = hand
     if type_ == 'str':
-        mapper = {'A': 14, 'K': 13, 'Q': 12, 'J': 11, 'T': 10}
-        c1_value, c2_value = card_1[0], card_2[0]
-        if card_1[0] in ['A', 'K', 'Q', 'J', 'T']:
-            c1_value = mapper[card_1[0]]
-        else:
-            c1_value = int(c1_value)
-
-        if card_2[0] in ['A', 'K', 'Q', 'J', 'T']:
-            c2_value = mapper[card_2[0]]
-        else:
-            c2_value = int(c2_value)
+        c1_value, c2_value = VALUE_MAPPER[card_1[0]], VALUE_MAPPER[card_2[0]]
 
         if c1_value >= c2_value:
             values = [card_1[0], card_2[0]]
@@ -373,16 +289,12 @@ def get_hand_equivalence_class(hand, type_='Card'):
         else:
             eq += 'o'
 
-    elif type_ == 'Card':
+    elif type_ in ('Card', 'code'):
+        code_1, code_2 = card_to_code(card_1), card_to_code(card_2)
 
-        if card_1.value >= card_2.value:
-            values = [card_1.str_value, card_2.str_value]
-        else:
-            values = [card_2.str_value, card_1.str_value]
+        eq = RANK_CHARS[max(code_1, code_2) >> 2] + RANK_CHARS[min(code_1, code_2) >> 2]
 
-        eq = str(values[0]) + str(values[1])
-
-        if card_1.suit == card_2.suit:  # is suited
+        if code_1 & 3 == code_2 & 3:  # is suited
             eq += 's'
         else:
             eq += 'o'
@@ -394,22 +306,167 @@ def get_hand_equivalence_class(hand, type_='Card'):
 
 
 def get_hand_rep(hand):
-    """ get hash value correspond to the given hand """
-    # hash over possible starting hands (total 196)
-    hand_rep = get_hand_equivalence_class(hand, type_='Card')
-    hand_hash_val = STARTING_HANDS_RANKING.index(hand_rep)
-    return hand_hash_val
+    """ get hash value correspond to the given hand (Cards or codes), i.e. its STARTING_HANDS_RANKING index """
+    card_1, card_2 = hand
+    return _HAND_INDEX_ROWS[card_to_code(card_1)][card_to_code(card_2)]
+
+
+def get_hands_rep(hero_cards):
+    """ vectorized get_hand_rep over [N, 2] hero hands of card codes """
+    hero_cards = np.asarray(hero_cards, dtype=np.int64)
+    return HAND_INDEX[hero_cards[:, 0], hero_cards[:, 1]]
+
+
+# STARTING_HANDS_RANKING index of every (card code, card code) combo (-1 for the same card twice)
+_HAND_CLASS_INDEX = {hand_class: idx for idx, hand_class in enumerate(STARTING_HANDS_RANKING)}
+HAND_INDEX = np.array([[_HAND_CLASS_INDEX[get_hand_equivalence_class((code_1, code_2), type_='code')]
+                        if code_1 != code_2 else -1 for code_2 in range(52)] for code_1 in range(52)], dtype=np.int64)
+_HAND_INDEX_ROWS = HAND_INDEX.tolist()
 
 
 def get_order_score(flop_cards, hero_cards):
     """
-    assume (At leasts for now) each card is instance of Card
+    each card is either a Card or its compact code
     """
-    board_values = [c.value for c in flop_cards]
+    board_values = [card_to_code(c) >> 2 for c in flop_cards]
     order_value = []
     for c in hero_cards:
-        order_value.append(sum([c.value > bv for bv in board_values]))
+        order_value.append(sum([card_to_code(c) >> 2 > bv for bv in board_values]))
     return FLOP_ORDER_HASH[tuple(sorted(order_value))]
 
 
+def canonical_hand_flop(hand, flop):
+    """
+    map a (hero hand, flop) pair (Cards or codes) into the representative of its suit-isomorphism class,
+    as (sorted hand codes, sorted flop codes): the suits are relabeled by decreasing signature (the suit's ranks in
+    the hand, then in the flop), which is the same for every pair of the class (suits with equal signatures are
+    interchangeable).
+    every suit-symmetric feature of the pair (strength, draws, equity against a range, ...) is a function of it
+    """
+    hand_codes = [card_to_code(c) for c in hand]
+    flop_codes = [card_to_code(c) for c in flop]
+    signatures = [0, 0, 0, 0]
+    for code in hand_codes:
+        signatures[code & 3] |= 1 << (13 + (code >> 2))
+    for code in flop_codes:
+        signatures[code & 3] |= 1 << (code >> 2)
+
+    labels = [0, 0, 0, 0]
+    for label, suit in enumerate(sorted(range(4), key=lambda suit: -signatures[suit])):
+        labels[suit] = label
+    return (tuple(sorted(code & ~3 | labels[code & 3] for code in hand_codes)),
+            tuple(sorted(code & ~3 | labels[code & 3] for code in flop_codes)))
+
+
+" Batch Featurization "
+
+_STRAIGHT_TOP_ARRAY = np.array(STRAIGHT_TOP, dtype=np.int8)
+_FLOP_ORDER_ARRAY = np.zeros((4, 4), dtype=np.int64)
+for (_low, _high), _idx in FLOP_ORDER_HASH.items():
+    _FLOP_ORDER_ARRAY[_low, _high] = _idx
+
+
+def _ranks_masks(ranks, select=None):
+    """ OR the rank bits of each row (optionally only where 'select' is set) into a 13-bit mask """
+    bits = np.left_shift(1, ranks)
+    if select is not None:
+        bits = np.where(select, bits, 0)
+    return np.bitwise_or.reduce(bits, axis=1)
+
+
+def batch_hand_rank(cards):
+    """ vectorized evaluate_codes(...)[0] over an [N, k] array of card codes (k <= 7) """
+    ranks, suits = cards >> 2, cards & 3
+    counts = (ranks[:, :, None] == np.arange(13)).sum(axis=1)
+    suit_counts = (suits[:, :, None] == np.arange(4)).sum(axis=1)
+
+    flush_suit = suit_counts.argmax(axis=1)
+    is_flush = suit_counts.max(axis=1) >= 5
+    flush_mask = _ranks_masks(ranks, suits == flush_suit[:, None])
+    is_straight_flush = is_flush & (_STRAIGHT_TOP_ARRAY[flush_mask] > 0)
+    is_straight = _STRAIGHT_TOP_ARRAY[_ranks_masks(ranks)] > 0
+
+    nof_4 = (counts == 4).sum(axis=1)
+    nof_3 = (counts == 3).sum(axis=1)
+    nof_2 = (counts == 2).sum(axis=1)
+
+    conditions = [is_straight_flush, nof_4 > 0, (nof_3 > 1) | ((nof_3 == 1) & (nof_2 > 0)), is_flush,
+                  is_straight, nof_3 == 1, nof_2 > 1, nof_2 == 1]
+    choices = [ROYAL_FLUSH, FOUR_OF_A_KIND, FULL_HOUSE, FLUSH, STRAIGHT, THREE_OF_A_KIND, TWO_PAIR, ONE_PAIR]
+    return np.select(conditions, choices, HIGH_CARD)
+
+
+def batch_draws(cards):
+    """ vectorized expand_evaluate_hand over an [N, k] array of card codes, packed as bits (first draw = bit 0) """
+    ranks, suits = cards >> 2, cards & 3
+    suit_counts = (suits[:, :, None] == np.arange(4)).sum(axis=1)
+    flush_draw = (suit_counts == 4).any(axis=1)
+    runner_flush_draw = ~flush_draw & (suit_counts == 3).any(axis=1)
+
+    # 14-bit mask where bit 0 is an ace played as 1
+    ranks_mask = _ranks_masks(ranks)
+    ranks_mask = (ranks_mask << 1) | (ranks_mask >> 12 & 1)
+    run_3 = ranks_mask & (ranks_mask >> 1) & (ranks_mask >> 2)
+    runner_straight_draw = run_3 != 0
+    straight_draw = (run_3 & (ranks_mask >> 3)) != 0
+
+    if cards.shape[1] == 5:
+        draws = [flush_draw, runner_flush_draw, straight_draw, runner_straight_draw]
+    else:
+        draws = [runner_flush_draw, runner_straight_draw]
+    return sum(draw.astype(np.int64) << bit for bit, draw in enumerate(draws))
+
 
+def batch_order_score(flops, hero_cards):
+    """ vectorized get_order_score over [N, 3] flops and [N, 2] hero hands of card codes """
+    above = ((hero_cards[:, :, None] >> 2) > (flops[:, None, :] >> 2)).sum(axis=2)
+    return _FLOP_ORDER_ARRAY[above.min(axis=1), above.max(axis=1)]
+
+
+def featurize(hero_cards, flops):
+    """
+    compute the cards features of the train data for N hands at once.
+    :param hero_cards: [N, 2] array of card codes
+    :param flops: [N, 3] array of card codes
+    :return: hands, hands_strength, flops_strength, hands_potential, flops_potential, cards_order (as in all_lists)
+    """
+    hero_cards = np.asarray(hero_cards, dtype=np.int64)
+    flops = np.asarray(flops, dtype=np.int64)
+    hands_and_flops = np.concatenate([hero_cards, flops], axis=1)
+
+    hands = get_hands_rep(hero_cards)
+    hands_strength = batch_hand_rank(hands_and_flops)
+    flops_strength = batch_hand_rank(flops)
+    hands_potential = batch_draws(hands_and_flops)
+    flops_potential = batch_draws(flops)
+    cards_order = batch_order_score(flops, hero_cards)
+    return hands, hands_strength, flops_strength, hands_potential, flops_potential, cards_order
+
+
+def batch_canonical_keys(hero_cards, flops):
+    """
+    vectorized canonical_hand_flop over [N, 2] hero hands and [N, 3] flops of card codes, each representative
+    encoded as a single int (see decode_canonical_keys), so equal classes get equal keys
+    """
+    cards = np.concatenate([np.asarray(hero_cards, dtype=np.int64), np.asarray(flops, dtype=np.int64)], axis=1)
+    ranks, suits = cards >> 2, cards & 3
+    rank_bits = np.left_shift(1, ranks + np.array([13, 13, 0, 0, 0]))
+    signatures = ((suits[:, :, None] == np.arange(4)) * rank_bits[:, :, None]).sum(axis=1)  # [N, 4]
+
+    labels = np.argsort(np.argsort(-signatures, axis=1, kind='stable'), axis=1)
+    cards = cards & ~3 | np.take_along_axis(labels, suits, axis=1)
+    cards = np.concatenate([np.sort(cards[:, :2], axis=1), np.sort(cards[:, 2:], axis=1)], axis=1)
+
+    keys = np.zeros(len(cards), dtype=np.int64)
+    for i in range(5):  # base 52 digits
+        keys = keys * 52 + cards[:, i]
+    return keys
+
+
+def decode_canonical_keys(keys):
+    """ inverse of batch_canonical_keys: return the [N, 2] hero hands and [N, 3] flops of the representatives """
+    keys = np.asarray(keys, dtype=np.int64)
+    cards = np.empty((len(keys), 5), dtype=np.int64)
+    for i in reversed(range(5)):
+        keys, cards[:, i] = np.divmod(keys, 52)
+    return cards[:, :2], cards[:, 2:]
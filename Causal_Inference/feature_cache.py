@@ -0,0 +1,79 @@
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from constants_and_methods import batch_canonical_keys, decode_canonical_keys, featurize
+
+
+" Constants "
+
+FEATURES = ['hands', 'hands_strength', 'flops_strength', 'hands_potential', 'flops_potential', 'cards_order']
+
+
+" Auxiliary Classes "
+
+
+class FeatureCache:
+    """
+    bounded LRU cache of the cards features (featurize output) of (hero hand, flop) pairs, keyed by their
+    suit-isomorphism class (see batch_canonical_keys), as all of them are suit-symmetric.
+    optionally persistent: loaded from 'path' if it exists, written back by save()
+    """
+
+    def __init__(self, maxsize=1 << 20, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()  # canonical key -> features tuple, least recently used first
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as file:
+                self.entries.update(pickle.load(file))
+            self._evict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _evict(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def featurize(self, hero_cards, flops):
+        """ same as constants_and_methods.featurize, computing only the classes missing from the cache """
+        keys, inverse = np.unique(batch_canonical_keys(hero_cards, flops), return_inverse=True)
+        features = np.empty((len(keys), len(FEATURES)), dtype=np.int64)
+
+        missing = []
+        for idx, key in enumerate(keys.tolist()):
+            cached = self.entries.get(key)
+            if cached is None:
+                missing.append(idx)
+            else:
+                self.entries.move_to_end(key)
+                features[idx] = cached
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            features[missing] = np.stack(featurize(*decode_canonical_keys(keys[missing])), axis=1)
+            for key, values in zip(keys[missing].tolist(), features[missing].tolist()):
+                self.entries[key] = tuple(values)
+            self._evict()
+
+        features = features[inverse.reshape(-1)]
+        return tuple(features[:, i] for i in range(len(FEATURES)))
+
+    def get(self, hand, flop):
+        """ the features of a single (hand, flop) pair of card codes, as a dict """
+        values = self.featurize([hand], [flop])
+        return {name: int(column[0]) for name, column in zip(FEATURES, values)}
+
+    def save(self, path=None):
+        """ write the cache to 'path' (default: the one it was loaded from) """
+        path = path or self.path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(dict(self.entries), file)
+        os.replace(tmp_path, path)
@@ -0,0 +1,98 @@
+import argparse
+import os
+from itertools import combinations
+from math import comb
+from multiprocessing import Pool
+
+import numpy as np
+
+from constants_and_methods import batch_canonical_keys, decode_canonical_keys, featurize, get_hands_rep
+
+
+" Constants "
+
+# the features stored in the table, by order (the hands feature is a plain HAND_INDEX lookup)
+TABLE_FEATURES = ['hands_strength', 'flops_strength', 'hands_potential', 'flops_potential', 'cards_order']
+MISSING = 255  # entry of the combos where the hand and the flop share a card
+
+# combo id of every hand: (card code, card code) -> [0, 1326)
+HANDS = np.array(list(combinations(range(52), 2)), dtype=np.int64)
+HAND_ID = np.full((52, 52), -1, dtype=np.int64)
+HAND_ID[HANDS[:, 0], HANDS[:, 1]] = HAND_ID[HANDS[:, 1], HANDS[:, 0]] = np.arange(len(HANDS))
+
+# combo id of every flop: colex rank of its sorted codes a < b < c, C(a, 1) + C(b, 2) + C(c, 3), in [0, 22100)
+_CHOOSE = np.array([[comb(n, k) for k in range(4)] for n in range(52)], dtype=np.int64)
+_flops = np.array(list(combinations(range(52), 3)), dtype=np.int64)
+FLOPS = _flops[np.argsort(_CHOOSE[_flops[:, 0], 1] + _CHOOSE[_flops[:, 1], 2] + _CHOOSE[_flops[:, 2], 3])]
+
+
+" Auxiliary Methods "
+
+
+def combo_ids(hero_cards, flops):
+    """ (hand id, flop id) of [N, 2] hero hands and [N, 3] flops of card codes """
+    hero_cards = np.asarray(hero_cards, dtype=np.int64)
+    flops = np.sort(np.asarray(flops, dtype=np.int64), axis=1)
+    flop_ids = _CHOOSE[flops[:, 0], 1] + _CHOOSE[flops[:, 1], 2] + _CHOOSE[flops[:, 2], 3]
+    return HAND_ID[hero_cards[:, 0], hero_cards[:, 1]], flop_ids
+
+
+def _hand_keys(hand_id):
+    """ pool worker: canonical keys of a hand with every flop (-1 where they share a card) """
+    hand = HANDS[hand_id]
+    valid = ~np.isin(FLOPS, hand).any(axis=1)
+    keys = np.full(len(FLOPS), -1, dtype=np.int64)
+    keys[valid] = batch_canonical_keys(np.broadcast_to(hand, (valid.sum(), 2)), FLOPS[valid])
+    return keys
+
+
+def _classes_features(keys):
+    """ pool worker: TABLE_FEATURES of the representatives of some canonical keys, as [n, 5] uint8 """
+    return np.stack(featurize(*decode_canonical_keys(keys))[1:], axis=1).astype(np.uint8)
+
+
+def build_feature_table(path, processes=None):
+    """
+    enumerate all the 1326 x 22100 (hand, flop) combos, featurize every suit-isomorphism class of them once (across
+    a process pool) and save the features of all the combos as a [1326, 22100, 5] uint8 .npy table
+    """
+    processes = processes or os.cpu_count()
+    with Pool(processes) as pool:
+        keys = np.stack(pool.map(_hand_keys, range(len(HANDS)), chunksize=16))
+        valid = keys >= 0
+        classes, inverse = np.unique(keys[valid], return_inverse=True)
+        features = np.concatenate(pool.map(_classes_features, np.array_split(classes, 4 * processes)))
+
+    table = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8, shape=keys.shape + (5,))
+    table[:] = MISSING
+    table[valid] = features[inverse.reshape(-1)]
+    table.flush()
+    del table
+    os.replace(path + '.tmp', path)
+    return len(classes)
+
+
+def load_feature_table(path):
+    """ memory-map a build_feature_table table, only the pages of the gathered combos are ever read """
+    return np.load(path, mmap_mode='r')
+
+
+def table_featurize(table, hero_cards, flops):
+    """ same as constants_and_methods.featurize, as a gather from a feature table """
+    hand_ids, flop_ids = combo_ids(hero_cards, flops)
+    features = table[hand_ids, flop_ids].astype(np.int64)
+    if (features == MISSING).any():
+        raise ValueError("hero cards and flop share a card")
+    hands = get_hands_rep(np.asarray(hero_cards, dtype=np.int64))
+    return (hands,) + tuple(features[:, i] for i in range(len(TABLE_FEATURES)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="build the exhaustive (hand, flop) features table")
+    parser.add_argument('output', nargs='?', default='data/feature_table.npy')
+    parser.add_argument('-p', '--processes', type=int, default=None, help="default: number of cpus")
+    args = parser.parse_args()
+
+    nof_classes = build_feature_table(args.output, args.processes)
+    print(f"{nof_classes} (hand, flop) classes saved to {args.output}")
@@ -0,0 +1,126 @@
+import os
+import random
+from functools import lru_cache
+from itertools import combinations
+from multiprocessing import Pool
+
+import numpy as np
+
+from constants_and_methods import (STARTING_HANDS_RANKING, evaluate_codes, get_hand_rep, batch_canonical_keys,
+                                   decode_canonical_keys)
+
+
+" Constants "
+
+SAMPLES = 1000  # Monte Carlo runouts per (hand, flop) class
+
+
+" Auxiliary Methods "
+
+_SCORES = {}  # evaluate_codes result -> hand_score
+_EQUITY_CACHE = {}  # (villain range, samples, seed) -> {canonical key: equity}
+
+
+def hand_score(codes):
+    """ evaluate_codes of up to 7 card codes as a single int, higher is better """
+    result = evaluate_codes(codes)
+    score = _SCORES.get(result)
+    if score is None:
+        hand_rank, rank_size, kickers = result
+        kickers = (tuple(kickers[:5]) if kickers else ()) + (0,) * 5
+        score = hand_rank << 12 | rank_size
+        for kicker in kickers[:5]:
+            score = score << 4 | kicker
+        _SCORES[result] = score
+    return score
+
+
+def top_range(fraction):
+    """ the top 'fraction' of the starting hands (by STARTING_HANDS_RANKING), as a villain range """
+    return STARTING_HANDS_RANKING[:max(1, round(fraction * len(STARTING_HANDS_RANKING)))]
+
+
+@lru_cache(maxsize=None)
+def _range_combos(villain_range):
+    classes = None if villain_range is None else {STARTING_HANDS_RANKING.index(hand) for hand in villain_range}
+    return [combo for combo in combinations(range(52), 2) if classes is None or get_hand_rep(combo) in classes]
+
+
+def range_combos(villain_range=None):
+    """
+    all the (card code, card code) combos of a range of hand classes (STARTING_HANDS_RANKING format, e.g. 'AKs',
+    'TTo'), None for any two cards
+    """
+    return _range_combos(None if villain_range is None else tuple(villain_range))
+
+
+def _showdown(hero_cards, villain_cards):
+    hero_score, villain_score = hand_score(hero_cards), hand_score(villain_cards)
+    return 1.0 if hero_score > villain_score else 0.5 if hero_score == villain_score else 0.0
+
+
+def hand_equity(hand, flop, villain_range=None, samples=SAMPLES, seed=0):
+    """
+    equity of the hero hand on the flop against a villain holding a random hand of 'villain_range', i.e.
+    P(win) + P(tie) / 2 over the turn and river runouts (nan if the range is empty given the known cards).
+    :param hand: 2 card codes
+    :param flop: 3 card codes
+    :param samples: number of Monte Carlo runouts, None to enumerate all the (villain hand, turn, river) runouts
+    """
+    hand, flop = list(hand), list(flop)
+    dead = set(hand + flop)
+    combos = [combo for combo in range_combos(villain_range) if not dead.intersection(combo)]
+    if not combos:
+        return float('nan')
+    deck = [c for c in range(52) if c not in dead]
+
+    if samples is None:
+        wins, nof_runouts = 0.0, 0
+        for villain in combos:
+            for runout in combinations([c for c in deck if c not in villain], 2):
+                wins += _showdown(hand + flop + list(runout), list(villain) + flop + list(runout))
+                nof_runouts += 1
+        return wins / nof_runouts
+
+    rng = random.Random(seed)
+    wins = 0.0
+    for _ in range(samples):
+        villain = rng.choice(combos)
+        # 4 distinct cards hold at least 2 that are not the villain's
+        runout = [c for c in rng.sample(deck, 4) if c not in villain][:2]
+        wins += _showdown(hand + flop + runout, list(villain) + flop + runout)
+    return wins / samples
+
+
+def _class_equity(task):
+    (hand, flop), villain_range, samples, seed = task
+    # the seed of every class depends on the class only, so results don't depend on the batch they were part of
+    return hand_equity(hand, flop, villain_range, samples, seed=hash((seed,) + hand + flop))
+
+
+def batch_hand_equity(hero_cards, flops, villain_range=None, samples=SAMPLES, seed=0, processes=None):
+    """
+    hand_equity of N (hand, flop) pairs, computed once per suit-isomorphism class (see batch_canonical_keys) and
+    cached across calls of this process. new classes are spread across a process pool (processes=1 to compute
+    them in this process, e.g. inside a pool worker)
+    :param hero_cards: [N, 2] array of card codes
+    :param flops: [N, 3] array of card codes
+    :return: [N] float array
+    """
+    keys, inverse = np.unique(batch_canonical_keys(hero_cards, flops), return_inverse=True)
+    cache = _EQUITY_CACHE.setdefault((None if villain_range is None else tuple(villain_range), samples, seed), {})
+
+    missing = [key for key in keys.tolist() if key not in cache]
+    if missing:
+        hands, missing_flops = decode_canonical_keys(missing)
+        tasks = [((tuple(hand), tuple(flop)), villain_range, samples, seed)
+                 for hand, flop in zip(hands.tolist(), missing_flops.tolist())]
+        if processes == 1:
+            results = [_class_equity(task) for task in tasks]
+        else:
+            processes = processes or os.cpu_count()
+            with Pool(processes) as pool:
+                results = pool.map(_class_equity, tasks, chunksize=max(1, len(tasks) // (4 * processes)))
+        cache.update(zip(missing, results))
+
+    return np.array([cache[key] for key in keys.tolist()], dtype=np.float64)[inverse.reshape(-1)]
@@ -0,0 +1,226 @@
+import csv
+import hashlib
+import json
+from ast import literal_eval
+
+import numpy as np
+
+from constants_and_methods import card_str_to_code
+
+
+" Constants "
+
+HERO = 0  # player code of 'Hero' in every game, the other players get 1, 2, ... by order of appearance
+
+ACTIONS = ['sb', 'bb', 'post bb', 'fold', 'check', 'call', 'bet', 'raise', 'win', 'lose']
+ACTION_INDEX = {action: idx for idx, action in enumerate(ACTIONS)}
+FOLD, CHECK, CALL, BET, RAISE = (ACTION_INDEX[a] for a in ['fold', 'check', 'call', 'bet', 'raise'])
+
+PREFLOP, FLOP, END = 0, 1, -1
+
+ACTION_COLUMNS = {'player': np.int8, 'stack': np.float64, 'action': np.int8, 'round': np.int8,
+                  'pot': np.float64, 'actions_detail': np.float64, 'position': np.int8}
+
+
+" Auxiliary Classes "
+
+
+class GamesChunk:
+    """
+    columnar representation of a chunk of games.
+    the actions of game i are rows offsets[i]:offsets[i+1] of the ACTION_COLUMNS arrays
+    """
+
+    def __init__(self, game_ids, hero_cards, flops, offsets, columns: dict):
+        self.game_ids = game_ids  # row number of the game in its source file
+        self.hero_cards = hero_cards  # [G, 2] card codes
+        self.flops = flops  # [G, 3] card codes (-1 if the game ended preflop)
+        self.offsets = offsets  # [G + 1]
+        self.columns = columns  # name -> [nof actions] array
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def __getattr__(self, name):
+        # expose the action columns as attributes (chunk.player, chunk.round, ...)
+        columns = self.__dict__.get('columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def game_of_rows(self):
+        """ index of the game each action row belongs to """
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def take(self, games_mask):
+        """ return a new chunk with only the games selected by the boolean 'games_mask' """
+        rows_mask = games_mask[self.game_of_rows()]
+        lengths = np.diff(self.offsets)[games_mask]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        columns = {name: values[rows_mask] for name, values in self.columns.items()}
+        return GamesChunk(self.game_ids[games_mask], self.hero_cards[games_mask], self.flops[games_mask], offsets,
+                          columns)
+
+
+" Auxiliary Methods "
+
+
+def parse_game_details(details_str):
+    """ parse a 'game details' cell (python dict repr), through json when possible as it's much faster """
+    try:
+        return json.loads(details_str.replace("'", '"'))
+    except json.JSONDecodeError:
+        return literal_eval(details_str)
+
+
+def first_index(chunk, rows_mask):
+    """ per game, the first action row where 'rows_mask' is set (len(rows_mask) if there is none) """
+    nof_rows = len(rows_mask)
+    candidates = np.where(rows_mask, np.arange(nof_rows), nof_rows)
+    return np.minimum.reduceat(candidates, chunk.offsets[:-1])
+
+
+def relevant_games_mask(chunk):
+    """
+    vectorized version of the processing.ipynb filter, keep only games where:
+    - single raiser and single caller preflop (i.e. 2-way flop)
+    - 'Hero' is the raiser
+    - checked to raiser and he cbet, with cbet/pot_size in [0,1]
+    """
+    starts = chunk.offsets[:-1]
+    nof_rows = len(chunk.action)
+    game_of_rows = chunk.game_of_rows()
+    preflop, flop = chunk.round == PREFLOP, chunk.round == FLOP
+
+    # single preflop raiser
+    aggressive = preflop & np.isin(chunk.action, [BET, RAISE])
+    single_raiser = np.add.reduceat(aggressive.astype(np.int64), starts) == 1
+
+    # exactly 2 players on the flop
+    players_bits = np.bitwise_or.reduceat(np.where(flop, np.left_shift(1, chunk.player.astype(np.int64)), 0), starts)
+    nof_flop_players = sum((players_bits >> bit) & 1 for bit in range(int(chunk.player.max(initial=0)) + 1))
+    heads_up = nof_flop_players == 2
+
+    # hero raised preflop
+    raise_row = first_index(chunk, preflop & (chunk.action == RAISE))
+    raiser = np.where(raise_row < nof_rows, chunk.player[np.minimum(raise_row, nof_rows - 1)], -1)
+    hero_raiser = raiser == HERO
+
+    # checked to the raiser and he bet at most the pot
+    is_raiser = chunk.player == raiser[game_of_rows]
+    raiser_row = first_index(chunk, flop & is_raiser)
+    not_checked_row = first_index(chunk, flop & ~is_raiser & (chunk.action != CHECK))
+    safe_raiser_row = np.minimum(raiser_row, nof_rows - 1)
+    cbet = (raiser_row < not_checked_row) & (raiser_row < nof_rows) & (chunk.action[safe_raiser_row] == BET)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cbet &= chunk.actions_detail[safe_raiser_row] / chunk.pot[safe_raiser_row] <= 1
+
+    return single_raiser & heads_up & hero_raiser & cbet
+
+
+def parse_rows(rows, header, only_relevant=True):
+    """
+    parse (game id, csv row) pairs into a GamesChunk
+    :param only_relevant: apply the relevant_games_mask filter on the fly
+    """
+    hero_cards_col, details_col = header.index('hero cards'), header.index('game details')
+    game_ids, hero_cards, flops, lengths = [], [], [], []
+    columns = {name: [] for name in ACTION_COLUMNS}
+
+    for game_id, row in rows:
+        game = parse_game_details(row[details_col])
+        hero = row[hero_cards_col]
+        game_ids.append(game_id)
+        hero_cards.append([card_str_to_code(hero[1:3]), card_str_to_code(hero[4:6])])
+
+        players = {'Hero': HERO}
+        columns['player'].extend(players.setdefault(p, len(players)) for p in game['player'])
+        columns['round'].extend(END if r == 'end' else r for r in game['round'])
+        columns['action'].extend(ACTION_INDEX[a] for a in game['action'])
+        for name in ['stack', 'pot', 'actions_detail', 'position']:
+            columns[name].extend(game[name])
+        lengths.append(len(game['action']))
+
+        flop = next((cards[:3] for r, cards in zip(game['round'], game['tables_cards']) if r == FLOP), None)
+        flops.append([card_str_to_code(c) for c in flop] if flop else [-1, -1, -1])
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    chunk = GamesChunk(game_ids=np.array(game_ids, dtype=np.int64),
+                       hero_cards=np.array(hero_cards, dtype=np.int8).reshape(-1, 2),
+                       flops=np.array(flops, dtype=np.int8).reshape(-1, 3),
+                       offsets=offsets,
+                       columns={name: np.array(values, dtype=ACTION_COLUMNS[name]) for name, values in columns.items()})
+    if only_relevant and len(chunk):
+        chunk = chunk.take(relevant_games_mask(chunk))
+    return chunk
+
+
+def read_row_chunks(path, chunk_size=10000):
+    """ stream the raw (game id, csv row) pairs of a hand histories csv file, yield (header, rows) chunks """
+    csv.field_size_limit(1 << 30)
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+
+        rows = []
+        for game_id, row in enumerate(reader):
+            rows.append((game_id, row))
+            if len(rows) == chunk_size:
+                yield header, rows
+                rows = []
+        if rows:
+            yield header, rows
+
+
+def read_new_row_chunks(path, record, chunk_size=10000):
+    """
+    same as read_row_chunks, skipping the rows already ingested according to 'record' (a dict, {} for a new file):
+    {'rows': number of rows ingested, 'digest': sha1 of the header and these rows}.
+    the skipped rows are checked against the digest, so a modified file is never silently half ingested.
+    once the generator is exhausted, 'record' is updated in place to cover the whole file
+    """
+    nof_ingested = record.get('rows', 0)
+    digest = hashlib.sha1()
+
+    def update(row):
+        digest.update('\x1f'.join(row).encode('utf-8') + b'\x1e')
+
+    csv.field_size_limit(1 << 30)
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        update(header)
+
+        for _ in range(nof_ingested):
+            row = next(reader, None)
+            if row is None:
+                raise RuntimeError(f"{path} is shorter than when it was ingested, rebuild the train data")
+            update(row)
+        if nof_ingested and digest.hexdigest() != record.get('digest'):
+            raise RuntimeError(f"{path} changed since it was ingested, rebuild the train data")
+
+        rows = []
+        nof_rows = nof_ingested
+        for game_id, row in enumerate(reader, start=nof_ingested):
+            update(row)
+            rows.append((game_id, row))
+            nof_rows = game_id + 1
+            if len(rows) == chunk_size:
+                yield header, rows
+                rows = []
+        if rows:
+            yield header, rows
+
+    record.update(rows=nof_rows, digest=digest.hexdigest())
+
+
+def read_games(path, chunk_size=10000, only_relevant=True):
+    """
+    stream a hand histories csv file (data/new.csv format) as GamesChunk instances of at most 'chunk_size' games,
+    so memory stays bounded by the chunk size and not the file size.
+    :param only_relevant: apply the relevant_games_mask filter on the fly
+    """
+    for header, rows in read_row_chunks(path, chunk_size):
+        yield parse_rows(rows, header, only_relevant)
@@ -0,0 +1,122 @@
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+
+
+" Constants "
+
+# name of each list in lists_data.pkl ('all_lists'), by order
+TRAIN_COLUMNS = ['treatment', 'outcomes', 'raiser_position', 'caller_position', 'open_sizes', 'raiser_stack',
+                 'caller_stack', 'pot_size', 'checked_to', 'hands', 'hands_strength', 'flops_strength',
+                 'hands_potential', 'flops_potential', 'cards_order', 'profits']
+
+MANIFEST = 'manifest.json'
+
+
+" Auxiliary Methods "
+
+
+def _columns_length(columns):
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"columns have different lengths: {lengths}")
+    return lengths.pop() if lengths else 0
+
+
+def _write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+
+def load_manifest(directory):
+    """ return the manifest of a columnar store (length, columns and metadata) """
+    with open(os.path.join(directory, MANIFEST)) as file:
+        return json.load(file)
+
+
+def save_columns(directory, columns: dict, metadata=None):
+    """
+    save named columns as a columnar store: one .npy file per column + a manifest with names, dtypes, length and
+    'metadata' (any json-able dict, e.g. the ingested sources).
+    the manifest of a store already there is removed first and the new one is written last, so a directory with a
+    manifest always holds a complete store (a crash midway leaves no store rather than a mix of old and new columns)
+    """
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        os.remove(os.path.join(directory, MANIFEST))
+    columns = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+
+    manifest = {'length': _columns_length(columns), 'columns': {}, 'metadata': metadata or {}}
+    for name, values in columns.items():
+        np.save(os.path.join(directory, f'{name}.npy'), values)
+        manifest['columns'][name] = {'file': f'{name}.npy', 'dtype': values.dtype.str}
+    _write_manifest(directory, manifest)
+
+
+def append_columns(directory, columns: dict, metadata=None):
+    """
+    append rows to the columns of a store (created if there is none), and replace its metadata if given.
+    the column files are rewritten first and the manifest last, so a crash in the middle leaves the store as it was
+    (load_columns ignores rows beyond the manifest length)
+    """
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        save_columns(directory, columns, metadata)
+        return
+
+    manifest = load_manifest(directory)
+    if set(columns) != set(manifest['columns']):
+        raise ValueError(f"appended columns {sorted(columns)} don't match the store's {sorted(manifest['columns'])}")
+    length = manifest['length']
+    nof_new_rows = _columns_length(columns)
+
+    for name, info in manifest['columns'].items():
+        if nof_new_rows == 0:
+            break
+        path = os.path.join(directory, info['file'])
+        values = np.asarray(columns[name]).astype(info['dtype'], casting='same_kind')
+        values = np.concatenate([np.load(path, mmap_mode='r')[:length], values])
+        with open(path + '.tmp', 'wb') as file:
+            np.save(file, values)
+        os.replace(path + '.tmp', path)
+
+    manifest['length'] = length + nof_new_rows
+    if metadata is not None:
+        manifest['metadata'] = metadata
+    _write_manifest(directory, manifest)
+
+
+def load_columns(directory, mmap=True):
+    """
+    load a columnar store as a dict of name -> array.
+    with 'mmap' the arrays are copy-on-write memory maps: nothing is read or unpickled up front, and they can be
+    wrapped by torch.from_numpy without copies
+    """
+    manifest = load_manifest(directory)
+
+    columns = {}
+    for name, info in manifest['columns'].items():
+        values = np.load(os.path.join(directory, info['file']), mmap_mode='c' if mmap else None)
+        if values.dtype.str != info['dtype'] or len(values) < manifest['length']:
+            raise RuntimeError(f"column '{name}' does not match the manifest of {directory}")
+        columns[name] = values[:manifest['length']]
+    return columns
+
+
+def lists_to_columns(all_lists):
+    """ name the 'all_lists' lists of lists_data.pkl and convert them into typed arrays """
+    return {name: np.asarray(values) for name, values in zip(TRAIN_COLUMNS, all_lists)}
+
+
+if __name__ == '__main__':
+
+    # convert a pickled all_lists into a columnar store, e.g. python train_store.py data/lists_data.pkl data/train_data
+    pickle_path, store_path = sys.argv[1:3]
+    with open(pickle_path, 'rb') as file:
+        all_lists = pickle.load(file)
+    save_columns(store_path, lists_to_columns(all_lists))
+    print(f"{len(all_lists[0])} rows saved to {store_path}")
@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import resource
+import signal
+import time
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+
+from unified_planning.engines import PlanGenerationResultStatus
+
+import classic_taxis_domain
+import stn_taxis_domain
+from plan_cache import load_plan, save_plan
+
+
+" Constants "
+
+DOMAINS = {'classic': classic_taxis_domain, 'stn': stn_taxis_domain}
+
+# status of a solved task: 'solved', 'unsolved' (the planner found no plan), 'timeout', 'memout' or 'failed'
+STATUSES = ['solved', 'unsolved', 'timeout', 'memout', 'failed']
+
+# status of a task by the planner's own status, the others (e.g. an internal error) are 'failed'
+PLANNER_STATUSES = {PlanGenerationResultStatus.SOLVED_SATISFICING: 'solved',
+                    PlanGenerationResultStatus.SOLVED_OPTIMALLY: 'solved',
+                    PlanGenerationResultStatus.UNSOLVABLE_PROVEN: 'unsolved',
+                    PlanGenerationResultStatus.UNSOLVABLE_INCOMPLETELY: 'unsolved',
+                    PlanGenerationResultStatus.TIMEOUT: 'timeout',
+                    PlanGenerationResultStatus.MEMOUT: 'memout'}
+
+
+" Auxiliary Methods "
+
+
+def task_dict(task):
+    """ the solve_taxis_problem dict of a problems_list.pkl task """
+    return {'map': task['map'], 'p_locs': task['p_locs'], 'p_dest': task['p_dests'], 't_locs': task['t_locs']}
+
+
+def _solve_task(method, problem_dict, memory_limit, cache_directory, connection):
+    """
+    task process: solve a task, save its plan to the plan cache at 'cache_directory' (if not None) and send
+    (status, plan, solving time, error) through 'connection'
+    """
+    # a process group of its own, so a timeout kills the planner subprocesses along with it
+    os.setsid()
+    if memory_limit is not None:
+        # inherited by the planner subprocesses
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    try:
+        result, sol_time = DOMAINS[method].solve_taxis_problem_result(problem_dict)
+    except MemoryError:
+        connection.send(('memout', None, None, None))
+        return
+    except Exception as e:
+        connection.send(('failed', None, None, repr(e)))
+        return
+
+    # a planner stopped by its memory limit (or an error) returns no plan either, but the task isn't unsolvable
+    status = PLANNER_STATUSES.get(result.status, 'failed')
+    if status != 'solved':
+        connection.send((status, None, None, result.status.name if status == 'failed' else None))
+        return
+
+    if cache_directory is not None:
+        try:
+            save_plan(DOMAINS[method], problem_dict, result.plan, sol_time, cache_directory)
+        except Exception:  # the cache is best-effort, a solved task stays solved
+            pass
+    connection.send(('solved', result.plan, sol_time, None))
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:  # killed before its setsid
+        process.kill()
+    process.join()
+
+
+def solve_batch(tasks, methods=('classic', 'stn'), processes=None, timeout=None, memory_limit=None,
+                cache_directory=None, verbose=True):
+    """
+    solve every task with every method, each in a process of its own and 'processes' of them at a time.
+    a task that runs out of time is killed (along with its planner) and recorded as a 'timeout', a crash or an
+    exception as a 'failed' task, so one task never hangs or stops the batch
+    :param tasks: problems_list.pkl tasks
+    :param timeout: wall-clock limit in seconds of each task, None for no limit
+    :param memory_limit: address space limit in bytes of each task (and of its planner), None for no limit
+    :param cache_directory: plan cache (see plan_cache) the tasks are looked up in before solving them, and their new
+    plans saved to, None for no cache
+    :return: method -> {'solutions', 'sol_times', 'statuses', 'errors'}, lists by the order of 'tasks' (None
+    solutions and solving times for the tasks that weren't solved)
+    """
+    processes = processes or os.cpu_count()
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        raise RuntimeError("solve_batch needs the 'fork' start method, which this platform doesn't have") from None
+
+    # the task processes are forked, so they inherit the map templates built here once per map
+    for task in tasks:
+        for method in methods:
+            DOMAINS[method].map_template(task['map'], nof_passengers=len(task['p_locs']))
+
+    results = {method: {'solutions': [None] * len(tasks), 'sol_times': [None] * len(tasks),
+                        'statuses': [None] * len(tasks), 'errors': [None] * len(tasks)} for method in methods}
+    pending = []
+    running = {}  # receiving connection -> (method, task index, process, start time)
+    nof_done = 0
+
+    def record(method, i, status, plan=None, sol_time=None, error=None, cached=False):
+        nonlocal nof_done
+        method_results = results[method]
+        method_results['statuses'][i], method_results['errors'][i] = status, error
+        method_results['solutions'][i], method_results['sol_times'][i] = plan, sol_time
+        nof_done += 1
+        if verbose:
+            print(f"[{nof_done}/{len(tasks) * len(methods)}] {method} task {i}: {status}"
+                  + (f" ({error})" if error else "") + (" (cached)" if cached else ""))
+
+    for i, task in enumerate(tasks):
+        for method in methods:
+            cached = None if cache_directory is None else load_plan(DOMAINS[method], task_dict(task), cache_directory)
+            if cached is not None:
+                record(method, i, 'solved', *cached, cached=True)
+            else:
+                pending.append((method, i))
+    pending.reverse()
+
+    while pending or running:
+
+        while pending and len(running) < processes:
+            method, i = pending.pop()
+            receiver, sender = Pipe(duplex=False)
+            process = context.Process(target=_solve_task,
+                                      args=(method, task_dict(tasks[i]), memory_limit, cache_directory, sender))
+            process.start()
+            sender.close()
+            running[receiver] = (method, i, process, time.time())
+
+        wait_time = None
+        if timeout is not None:
+            wait_time = max(0.0, min(start + timeout for _, _, _, start in running.values()) - time.time())
+
+        for receiver in wait(list(running), wait_time):
+            method, i, process, _ = running.pop(receiver)
+            try:
+                status, plan, sol_time, error = receiver.recv()
+            except EOFError:  # died without a result, e.g. killed by the memory limit
+                status, plan, sol_time, error = 'failed', None, None, None
+            receiver.close()
+            process.join()
+            if error is None and status == 'failed':
+                error = f"exit code {process.exitcode}"
+            record(method, i, status, plan, sol_time, error)
+
+        if timeout is not None:
+            now = time.time()
+            for receiver, (method, i, process, start) in list(running.items()):
+                if now - start >= timeout:
+                    del running[receiver]
+                    _kill(process)
+                    receiver.close()
+                    record(method, i, 'timeout')
+
+    return results
@@ -1,8 +1,9 @@
-from stn_taxis_domain import solve_taxis_problem as stn_solver
-from classic_taxis_domain import solve_taxis_problem as classic_solver
+from batch_solver import solve_batch, STATUSES
+from plan_cache import CACHE_DIR
+import argparse
+import os
 import pickle
 import pandas as pd
-from tqdm import tqdm
 
 
 def count_taxis_actions(sol):
@@ -25,28 +26,27 @@ P = 6
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="solve the tasks with the classic and STN methods and compare them")
+    parser.add_argument('-p', '--processes', type=int, default=None, help="tasks solved at a time, default: cpus")
+    parser.add_argument('-t', '--timeout', type=float, default=None, help="wall-clock limit of a task, in seconds")
+    parser.add_argument('-m', '--memory-limit', type=int, default=None, help="memory limit of a task, in MB")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="plan cache directory, default: %(default)s")
+    parser.add_argument('--no-cache', action='store_true', help="solve every task, without the plan cache")
+    args = parser.parse_args()
+
     " Solve problems "
 
     with open(r"problems/problems_list.pkl", 'rb') as file:
         all_tasks = pickle.load(file)
 
+    memory_limit = None if args.memory_limit is None else args.memory_limit * 2 ** 20
+    all_results = solve_batch(all_tasks, methods=('classic', 'stn'), processes=args.processes, timeout=args.timeout,
+                              memory_limit=memory_limit, cache_directory=None if args.no_cache else args.cache_dir)
+    classic_results, stn_results = all_results['classic'], all_results['stn']
 
-    classic_results = {'solutions': [], 'sol_times': []}
-    for task in tqdm(all_tasks):
-        sol, sol_time = classic_solver({'map': task['map'], 'p_locs': task['p_locs'], 'p_dest': task['p_dests'],
-                                        't_locs': task['t_locs']})
-        classic_results['solutions'].append(sol)
-        classic_results['sol_times'].append(sol_time)
+    os.makedirs("results", exist_ok=True)
     with open("results/classic_results.pkl", 'wb') as file:
         pickle.dump(classic_results, file)
-
-
-    stn_results = {'solutions': [], 'sol_times': []}
-    for task in tqdm(all_tasks):
-        task_dict = {'map': task['map'], 'p_locs': task['p_locs'], 'p_dest': task['p_dests'], 't_locs': task['t_locs']}
-        sol, sol_time = stn_solver(task_dict)
-        stn_results['solutions'].append(sol)
-        stn_results['sol_times'].append(sol_time)
     with open("results/stn_results.pkl", 'wb') as file:
         pickle.dump(stn_results, file)
 
@@ -54,6 +54,10 @@ if __name__ == '__main__':
     # ____________________________________________
 
 
+    # the comparison is over the tasks both methods solved
+    solved_tasks = [i for i in range(len(all_tasks)) if
+                    classic_results['statuses'][i] == 'solved' and stn_results['statuses'][i] == 'solved']
+
     results_comparison = {
         'methods': ['classic', 'STN'],
         'overall time': [0, 0],
@@ -61,8 +65,10 @@ if __name__ == '__main__':
         'overall actions': [0, 0],
         'average actions': [0, 0]
     }
+    for status in STATUSES:
+        results_comparison[status] = [classic_results['statuses'].count(status), stn_results['statuses'].count(status)]
 
-    for i in range(len(all_tasks)):
+    for i in solved_tasks:
 
         results_comparison['overall actions'][0] += count_taxis_actions(classic_results['solutions'][i])
         results_comparison['overall actions'][1] += count_taxis_actions(stn_results['solutions'][i])
@@ -70,11 +76,12 @@ if __name__ == '__main__':
         results_comparison['overall time'][0] += classic_results['sol_times'][i]
         results_comparison['overall time'][1] += stn_results['sol_times'][i]
 
-    results_comparison['average time'][0] = results_comparison['overall time'][0] / len(all_tasks)
-    results_comparison['average time'][1] = results_comparison['overall time'][1] / len(all_tasks)
+    nof_solved = max(len(solved_tasks), 1)
+    results_comparison['average time'][0] = results_comparison['overall time'][0] / nof_solved
+    results_comparison['average time'][1] = results_comparison['overall time'][1] / nof_solved
 
-    results_comparison['average actions'][0] = results_comparison['overall actions'][0] / len(all_tasks)
-    results_comparison['average actions'][1] = results_comparison['overall actions'][1] / len(all_tasks)
+    results_comparison['average actions'][0] = results_comparison['overall actions'][0] / nof_solved
+    results_comparison['average actions'][1] = results_comparison['overall actions'][1] / nof_solved
 
 
     print(pd.DataFrame(results_comparison))
@@ -1,7 +1,9 @@
 import random
 import simulation_manager
 import pickle
-from stn_taxis_domain import solve_taxis_problem as stn_solver
+import stn_taxis_domain
+from batch_solver import task_dict
+from plan_cache import solve_cached
 
 
 if __name__ == '__main__':
@@ -13,15 +15,16 @@ if __name__ == '__main__':
     # choose a task randomly
     cur_task = random.choice(all_tasks)
 
-    # solve the task
-    plan, _ = stn_solver(cur_task)
+    # solve the task (or load its plan from the plan cache)
+    problem_dict = task_dict(cur_task)
+    plan, _ = solve_cached(stn_taxis_domain, problem_dict)
 
     # simulate results
     sim = simulation_manager.SimulationManager(
         world_map=cur_task['map'],
         t_locs=cur_task['t_locs'],
         p_locs=cur_task['p_locs'],
-        p_dest=cur_task['p_dest'],
+        p_dest=problem_dict['p_dest'],
         actions=plan.actions
     )
     sim.run()
@@ -0,0 +1,105 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+from functools import lru_cache
+
+from unified_planning.plans import SequentialPlan, ActionInstance
+
+
+" Constants "
+
+CACHE_DIR = 'results/plan_cache'
+
+
+" Auxiliary Methods "
+
+
+@lru_cache(maxsize=None)
+def _source_hash(domain_file):
+    with open(domain_file, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+
+def task_hash(domain, problem_dict):
+    """
+    canonical hash of a task (solve_taxis_problem dict) and the domain variant solving it: the domain module and its
+    num_switches, if it has any
+    """
+    num_switches = inspect.signature(domain.initialize_environment).parameters.get('num_switches')
+    canonical = {
+        'domain': domain.__name__,
+        'num_switches': None if num_switches is None else num_switches.default,
+        'map': [[int(cell) for cell in row] for row in problem_dict['map']],
+        'p_locs': [[int(c) for c in loc] for loc in problem_dict['p_locs']],
+        'p_dest': [[int(c) for c in loc] for loc in problem_dict['p_dest']],
+        't_locs': [[int(c) for c in loc] for loc in problem_dict['t_locs']]
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+
+def _plan_path(domain, problem_dict, directory):
+    # the plans of a domain are kept under the hash of its builder code, so changing it invalidates them
+    return os.path.join(directory, domain.__name__, _source_hash(domain.__file__),
+                        task_hash(domain, problem_dict) + '.json')
+
+
+def load_plan(domain, problem_dict, directory=CACHE_DIR):
+    """
+    :return: the cached (plan, solving time) of a task, rebuilt over the task's problem, or None if there is none
+    """
+    path = _plan_path(domain, problem_dict, directory)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        entry = json.load(file)
+
+    problem = domain.initialize_environment(a_map=problem_dict['map'],
+                                            passengers_locations=problem_dict['p_locs'],
+                                            passengers_destinations=problem_dict['p_dest'],
+                                            taxis_locations=problem_dict['t_locs'])
+    objects = {obj.name: obj for obj in problem.all_objects}
+    actions = [ActionInstance(problem.action(name), tuple(objects[param] for param in params))
+               for name, params in entry['actions']]
+    return SequentialPlan(actions), entry['sol_time']
+
+
+def save_plan(domain, problem_dict, plan, sol_time, directory=CACHE_DIR):
+    """ cache the plan of a task as its actions names and parameters, along with its solving time """
+    path = _plan_path(domain, problem_dict, directory)
+    plans_directory = os.path.dirname(path)
+    if not os.path.isdir(plans_directory):
+        os.makedirs(plans_directory, exist_ok=True)
+        # a new version of the domain builder, the plans of the previous ones are stale (only their directories are
+        # removed, so processes saving the first plans of this version at the same time don't remove each other's)
+        domain_directory = os.path.dirname(plans_directory)
+        for version in os.listdir(domain_directory):
+            if version != os.path.basename(plans_directory):
+                shutil.rmtree(os.path.join(domain_directory, version), ignore_errors=True)
+
+    entry = {'actions': [[action.action.name, [param.object().name for param in action.actual_parameters]]
+                         for action in plan.actions],
+             'sol_time': sol_time}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(entry, file, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def solve_cached(domain, problem_dict, directory=CACHE_DIR):
+    """
+    same as domain.solve_taxis_problem, but the plans are looked up in / saved to the plan cache at 'directory'
+    (the solving time of a cached plan is the one of the run that solved it)
+    """
+    cached = load_plan(domain, problem_dict, directory)
+    if cached is not None:
+        return cached
+
+    plan, sol_time = domain.solve_taxis_problem(problem_dict)
+    if plan is not None:
+        try:
+            save_plan(domain, problem_dict, plan, sol_time, directory)
+        except Exception as e:  # the cache is best-effort, the plan is still returned
+            print(f"plan cache: failed to save a plan ({e})")
+    return plan, sol_time
@@ -9,18 +9,23 @@ S = 2
 I = 5
 P = 6
 
+_TEMPLATES = {}  # (map, nof_taxis, nof_passengers, ...) -> (template problem, its task fluents & objects)
 
-def initialize_environment(a_map, passengers_locations, passengers_destinations, taxis_locations, nof_taxis=4,
-                           num_switches=20):
+
+def _build_template(a_map, nof_taxis, nof_passengers, num_switches, sparse):
+    """
+    build the problem of a map without the task facts: the taxis & passengers locations and their goals
+    :param sparse: the static relations (locations neighborhood, counters order) default to False and only their
+    true facts are set, instead of setting every pair explicitly
+    """
 
     map_rows_size, map_cols_size = len(a_map), len(a_map[0])
-    nof_passengers = len(passengers_locations)
 
-    blocked_locations = [(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == X]
-    station_locations = [(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == S]
-    intersection_locations = [(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == I]
-    pre_intersection_locations = [(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if
-                                  a_map[i][j] == P]
+    blocked_locations = {(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == X}
+    station_locations = {(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == S}
+    intersection_locations = {(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if a_map[i][j] == I}
+    pre_intersection_locations = {(i, j) for i in range(map_rows_size) for j in range(map_cols_size) if
+                                  a_map[i][j] == P}
 
     xy_locations = [(x, y) for x in range(map_rows_size) for y in range(map_cols_size)]
 
@@ -38,6 +43,7 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
 
     locations = [Object(f'loc({x},{y})', Location) for x in range(map_rows_size) for y in range(map_cols_size)]
     problem.add_objects(locations)
+    location_of = dict(zip(xy_locations, locations))  # (x, y) -> location object
 
     taxis = [Object(f'taxi_{i}', Taxi) for i in range(1, nof_taxis + 1)]
     problem.add_objects(taxis)
@@ -98,8 +104,10 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
                is_right, is_left, is_up, is_down, moving_up, moving_down, moving_right, moving_left,
                is_horizontal, is_vertical, waiting_on_v, waiting_on_h, times_switched, next]
 
+    static_relations = [is_adjacent, is_right, is_left, is_up, is_down, next]
     for fluent in fluents:
-        problem.add_fluent(fluent)
+        sparse_fluent = sparse and any(fluent is relation for relation in static_relations)
+        problem.add_fluent(fluent, default_initial_value=False if sparse_fluent else None)
 
 
     # ---------- Define actions ----------
@@ -326,8 +334,8 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
                                waiting_on_v(taxi_params[2], l), waiting_on_v(taxi_params[3], l)))
 
     for t in taxi_params:
-        for loc in intersection_locations:
-            loc_obj = locations[xy_locations.index(loc)]
+        for loc in sorted(intersection_locations):
+            loc_obj = location_of[loc]
             h_to_v.add_precondition(~taxi_at(taxi, loc_obj))
         h_to_v.add_effect(waiting_on_v(t, l), False)
     h_to_v.add_effect(is_horizontal(l), False)
@@ -358,8 +366,8 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
                                waiting_on_h(taxi_params[2], l), waiting_on_h(taxi_params[3], l)))
 
     for t in taxi_params:
-        for loc in intersection_locations:
-            loc_obj = locations[xy_locations.index(loc)]
+        for loc in sorted(intersection_locations):
+            loc_obj = location_of[loc]
             v_to_h.add_precondition(~taxi_at(taxi, loc_obj))
         v_to_h.add_effect(waiting_on_h(t, l), False)
     v_to_h.add_effect(is_horizontal(l), True)
@@ -371,17 +379,8 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
 
     # ---------- Set goal ----------
 
-    for i, xy_loc in enumerate(passengers_destinations):
-
-        loc_obj = locations[xy_locations.index(xy_loc)]
-        problem.add_goal(passenger_at(passengers[i], loc_obj))
-
-    for i, xy_loc in enumerate(taxis_locations):
-        loc_obj = locations[xy_locations.index(xy_loc)]
-        problem.add_goal(taxi_at(taxis[i], loc_obj))
-
+    # added after the task goals, see initialize_environment
     light_condition = Or(times_switched(light, counters[-i]) for i in range(0, num_switches))
-    problem.add_goal(light_condition)
 
     # ---------- Set initial values ----------
 
@@ -401,17 +400,20 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
         else:
             problem.set_initial_value(times_switched(light, c), False)
 
-    for i, c1 in enumerate(counters):
-        for j, c2 in enumerate(counters):
-            if j == i+1:
-                problem.set_initial_value(next(c1, c2), True)
-            else:
-                problem.set_initial_value(next(c1, c2), False)
+    if sparse:
+        for c1, c2 in zip(counters, counters[1:]):
+            problem.set_initial_value(next(c1, c2), True)
+    else:
+        for i, c1 in enumerate(counters):
+            for j, c2 in enumerate(counters):
+                if j == i+1:
+                    problem.set_initial_value(next(c1, c2), True)
+                else:
+                    problem.set_initial_value(next(c1, c2), False)
 
     # locations
 
-    for i, loc in enumerate(locations):
-        xy_loc = xy_locations[i]
+    for xy_loc, loc in zip(xy_locations, locations):
 
         # lane direction
 
@@ -449,37 +451,38 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
         for p in passengers:
             problem.set_initial_value(passenger_at(p, loc), False)
 
-    # adjacent location
+    # adjacent & next to locations
 
-    for loc1 in locations:
-        for loc2 in locations:
-            x1, y1 = xy_locations[locations.index(loc1)]
-            x2, y2 = xy_locations[locations.index(loc2)]
-            is_adj = (abs(x1 - x2) == 1 and y1 == y2) or (abs(y1 - y2) == 1 and x1 == x2)
-            problem.set_initial_value(is_adjacent(loc1, loc2), is_adj)
+    if sparse:
+        directions = [((0, 1), is_right), ((0, -1), is_left), ((-1, 0), is_up), ((1, 0), is_down)]
+        for (x, y), loc in zip(xy_locations, locations):
+            for (dx, dy), is_direction in directions:
+                neighbor = location_of.get((x + dx, y + dy))
+                if neighbor is not None:
+                    problem.set_initial_value(is_adjacent(loc, neighbor), True)
+                    problem.set_initial_value(is_direction(loc, neighbor), True)
 
-    # next to locations
+    else:
+        for (x1, y1), loc1 in zip(xy_locations, locations):
+            for (x2, y2), loc2 in zip(xy_locations, locations):
+                is_adj = (abs(x1 - x2) == 1 and y1 == y2) or (abs(y1 - y2) == 1 and x1 == x2)
+                problem.set_initial_value(is_adjacent(loc1, loc2), is_adj)
 
-    for loc1 in locations:
-        for loc2 in locations:
-            x1, y1 = xy_locations[locations.index(loc1)]
-            x2, y2 = xy_locations[locations.index(loc2)]
+        for (x1, y1), loc1 in zip(xy_locations, locations):
+            for (x2, y2), loc2 in zip(xy_locations, locations):
 
-            is_r = x1 == x2 and y1 + 1 == y2
-            is_l = x1 == x2 and y1 - 1 == y2
-            is_u = x1 - 1 == x2 and y1 == y2
-            is_d = x1 + 1 == x2 and y1 == y2
+                is_r = x1 == x2 and y1 + 1 == y2
+                is_l = x1 == x2 and y1 - 1 == y2
+                is_u = x1 - 1 == x2 and y1 == y2
+                is_d = x1 + 1 == x2 and y1 == y2
 
-            problem.set_initial_value(is_right(loc1, loc2), is_r)
-            problem.set_initial_value(is_left(loc1, loc2), is_l)
-            problem.set_initial_value(is_up(loc1, loc2), is_u)
-            problem.set_initial_value(is_down(loc1, loc2), is_d)
+                problem.set_initial_value(is_right(loc1, loc2), is_r)
+                problem.set_initial_value(is_left(loc1, loc2), is_l)
+                problem.set_initial_value(is_up(loc1, loc2), is_u)
+                problem.set_initial_value(is_down(loc1, loc2), is_d)
 
     # taxis
     for i, taxi in enumerate(taxis):
-        loc_obj = locations[xy_locations.index(taxis_locations[i])]
-        problem.set_initial_value(taxi_at(taxi, loc_obj), True)
-        problem.set_initial_value(is_occupied(loc_obj), True)
         problem.set_initial_value(taxi_busy(taxi), False)
         problem.set_initial_value(passenger_of_taxi(passengers[i], taxi), True)
 
@@ -490,23 +493,69 @@ def initialize_environment(a_map, passengers_locations, passengers_destinations,
         problem.set_initial_value(moving_left(taxi), False)
 
     # passengers
-    for i, p in enumerate(passengers_locations):
-        loc_obj = locations[xy_locations.index(passengers_locations[i])]
-        problem.set_initial_value(passenger_at(passengers[i], loc_obj), True)
+    for i, p in enumerate(passengers):
         for j, t in enumerate(taxis):
-            problem.set_initial_value(passenger_on(passengers[i], t), False)
+            problem.set_initial_value(passenger_on(p, t), False)
             if j == i:
-                problem.set_initial_value(passenger_of_taxi(passengers[i], t), True)
+                problem.set_initial_value(passenger_of_taxi(p, t), True)
             else:
-                problem.set_initial_value(passenger_of_taxi(passengers[i], t), False)
+                problem.set_initial_value(passenger_of_taxi(p, t), False)
 
     # ____________________________________________________________
 
-    return problem
+    task_parts = {'location_of': location_of, 'taxis': taxis, 'passengers': passengers, 'taxi_at': taxi_at,
+                  'passenger_at': passenger_at, 'is_occupied': is_occupied, 'light_condition': light_condition}
+    return problem, task_parts
 
 
-def solve_taxis_problem(problem_dict):
+def map_template(a_map, nof_taxis=4, nof_passengers=4, num_switches=20, sparse=True):
+    """
+    the problem of a map (types, objects, fluents, actions and every initial value that doesn't depend on the task),
+    built once per map identity and cached. the cached problem is shared, so clone it before setting a task on it
+    :return: the template problem and a dict of the fluents & objects the task facts are set with
+    """
+    key = (tuple(tuple(row) for row in a_map), nof_taxis, nof_passengers, num_switches, sparse)
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = _build_template(a_map, nof_taxis, nof_passengers, num_switches, sparse)
+    return _TEMPLATES[key]
+
+
+def initialize_environment(a_map, passengers_locations, passengers_destinations, taxis_locations, nof_taxis=4,
+                           num_switches=20, sparse=True):
+    """ clone the template of the map and set the task facts on it: taxis & passengers locations and goals """
+    template, task_parts = map_template(a_map, nof_taxis, len(passengers_locations), num_switches, sparse)
+    problem = template.clone()
+    location_of, taxis, passengers = task_parts['location_of'], task_parts['taxis'], task_parts['passengers']
+    taxi_at, passenger_at, is_occupied = task_parts['taxi_at'], task_parts['passenger_at'], task_parts['is_occupied']
+
+    # ---------- Set goal ----------
+
+    for i, xy_loc in enumerate(passengers_destinations):
 
+        loc_obj = location_of[xy_loc]
+        problem.add_goal(passenger_at(passengers[i], loc_obj))
+
+    for i, xy_loc in enumerate(taxis_locations):
+        loc_obj = location_of[xy_loc]
+        problem.add_goal(taxi_at(taxis[i], loc_obj))
+
+    problem.add_goal(task_parts['light_condition'])
+
+    # ---------- Set initial values ----------
+
+    for i, taxi in enumerate(taxis):
+        loc_obj = location_of[taxis_locations[i]]
+        problem.set_initial_value(taxi_at(taxi, loc_obj), True)
+        problem.set_initial_value(is_occupied(loc_obj), True)
+
+    for i, xy_loc in enumerate(passengers_locations):
+        problem.set_initial_value(passenger_at(passengers[i], location_of[xy_loc]), True)
+
+    return problem
+
+
+def solve_taxis_problem_result(problem_dict):
+    """ same as solve_taxis_problem, but return the planner's whole result (e.g. its status) instead of its plan """
     problem = initialize_environment(a_map=problem_dict['map'],
                                      passengers_locations=problem_dict['p_locs'],
                                      passengers_destinations=problem_dict['p_dest'],
@@ -519,4 +568,10 @@ def solve_taxis_problem(problem_dict):
         result = planner.solve(problem)
         solving_time = time.time() - start_time
 
-        return result.plan, solving_time
+        return result, solving_time
+
+
+def solve_taxis_problem(problem_dict):
+
+    result, solving_time = solve_taxis_problem_result(problem_dict)
+    return result.plan, solving_time